@@ -1,41 +1,276 @@
-import tkinter as tk
-from tkinter import messagebox, ttk
-import pandas as pd
+import time
+INICIO_PROCESSO = time.perf_counter()  # referência dos marcos de inicialização
 import os
-import requests
+import sys
+import importlib
+import importlib.util
 import urllib.parse
-import undetected_chromedriver as uc
+from html.parser import HTMLParser
 from selenium.webdriver.common.by import By
-from PIL import Image, ImageTk, ImageEnhance, ImageOps, ImageFilter
+from PIL import Image, ImageEnhance, ImageOps, ImageFilter
 from datetime import datetime, timedelta
-import pytesseract
+try:
+    # Bindings da API C do Tesseract (opcional): OCR no próprio processo
+    import tesserocr
+except ImportError:
+    tesserocr = None
 from io import BytesIO
 from PIL import Image as PILImage
 import traceback
-import cv2
-import numpy as np
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import WebDriverException, StaleElementReferenceException, NoSuchElementException, JavascriptException
 import unicodedata
+import argparse
+import base64
+import hashlib
+import subprocess
+import json
+import re
+import sqlite3
+import threading
+import shutil
+import fnmatch
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+class ModuloTardio:
+    # Importa o módulo no primeiro acesso a um atributo: a inicialização não paga os
+    # imports pesados (Chrome, OCR, HTTP) de etapas que ainda não rodaram
+    def __init__(self, nome):
+        self._nome = nome
+        self._modulo = None
+
+    def __getattr__(self, atributo):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nome)
+        return getattr(self._modulo, atributo)
+
+requests = ModuloTardio("requests")
+urllib3 = ModuloTardio("urllib3")
+uc = ModuloTardio("undetected_chromedriver")
+pytesseract = ModuloTardio("pytesseract")
+cv2 = ModuloTardio("cv2")
+np = ModuloTardio("numpy")
+# Interface gráfica: o modo headless e o motor HTTP rodam em Pythons sem Tk (containers)
+tk = ModuloTardio("tkinter")
+messagebox = ModuloTardio("tkinter.messagebox")
+ttk = ModuloTardio("tkinter.ttk")
+ImageTk = ModuloTardio("PIL.ImageTk")
+# Opcional: só usado para medir memória no benchmark de OCR
+psutil = ModuloTardio("psutil") if importlib.util.find_spec("psutil") is not None else None
 
 # === CONFIGURAÇÕES ===
 ARQUIVO_PLANILHA = "CVM_Links.xlsx"
 ARQUIVO_LOG = "resultado_extracao.log"
+ARQUIVO_BANCO = "estado_extracao.sqlite3"
 PASTA_FORMULARIOS = "formularios"
 PASTA_CAPTCHAS = "captchas"
 ARQUIVO_HTML_DIAGNOSTICO = "diagnostico_captchas.html"
+# Com --servidor (ex.: servidor_teste_cvm.py) banco, log, formulários e captchas vão para
+# uma pasta separada e a coleta de CAPTCHAs fica desligada: o teste não mexe no estado real
+PASTA_SAIDA_TESTE = "saida_servidor_teste"
+# Tabela do comando "reprocessar-captchas" (captchas/ relidos com outras configurações)
+ARQUIVO_REPROCESSAMENTO = "reprocessamento_captchas.html"
+LOTE_REPROCESSAMENTO = 64
 LOGO_PATH = "cvm_logo.png"
+# Endereço do CAPTCHA relativo à página da empresa
+CAMINHO_CAPTCHA = "captcha/aspcaptcha.asp"
+XPATH_CAPTCHA = f"//img[contains(@src, '{CAMINHO_CAPTCHA}')]"
+TEXTO_LINK_FORMULARIO = "Formulário de Referência"
+# CAPTCHAs novos por empresa quando o OCR não responde ou o site recusa o código.
+# A renovação troca só a imagem (ou reaproveita a página de recusa), sem navegar de novo.
+RENOVACOES_CAPTCHA = 3
+PSMS_OCR = [6, 7, 8, 13]
+# Todos os PSMs rodam e votam posição a posição; abaixo disso o CAPTCHA não é enviado
+CONFIANCA_MINIMA_TESSERACT = 0.5
+# Modelo Tesseract especializado, gerado pelo comando "treinar-tesseract" em
+# modelos/cvm.traineddata; o backend "tesseract-cvm" o usa com um único PSM
+PASTA_MODELOS = "modelos"
+MODELO_TESSERACT_CVM = "cvm"
+PSM_MODELO_CVM = 7
+# Ordem dos PSMs aprendida com os códigos aceitos pelo site (tabela psm_estatisticas).
+# O melhor PSM roda sozinho primeiro e basta se taxa de acerto x confiança passar do
+# limite; PSMs com histórico suficiente e taxa baixa deixam de rodar.
+CONFIANCA_MINIMA_PSM_UNICO = 0.8
+MINIMO_TENTATIVAS_PSM = 30
+TAXA_MINIMA_PSM = 0.2
+# Variantes de pré-processamento lidas em paralelo pelo backend "tesseract-variantes"
+# (ver VARIANTES_PREPROCESSAMENTO). O benchmark mede cada uma (tabela
+# variantes_avaliacoes); as que quase nunca acertam saem e no máximo
+# MAXIMO_VARIANTES rodam por CAPTCHA. "opencv" sempre roda.
+MINIMO_AVALIACOES_VARIANTE = 20
+TAXA_MINIMA_VARIANTE = 0.2
+MAXIMO_VARIANTES = 3
+# O voto das variantes é mais confiante que o dos PSMs, inclusive quando erra: no
+# benchmark (cvm_treino) houve leituras erradas com 0.975. Com 0.98 só respondem as
+# leituras certas; as demais seguem para o Tesseract com vários PSMs.
+CONFIANCA_MINIMA_VARIANTES = 0.98
+WHITELIST_OCR = "0123456789"
+# Usa o tesserocr quando instalado; False força um processo tesseract por chamada (pytesseract)
+USAR_TESSEROCR = True
+# Backends de OCR, na ordem em que são tentados (ver BACKENDS_OCR). "knn" é o
+# classificador de dígitos (NumPy) treinado com as amostras rotuladas de cvm_treino;
+# se a margem entre o melhor dígito e o segundo for pequena, passa para o próximo.
+# "cnn" só responde depois de "treinar-cnn" gerar o modelo.
+ORDEM_OCR = ["knn", "cnn", "tesseract-variantes", "tesseract"]
+PASTA_TREINO = os.path.join("cvm_treino", "captchas")
+ARQUIVO_LABELS_TREINO = os.path.join("cvm_treino", "labels.txt")
+MARGEM_CLASSIFICADOR = 0.05
+# CAPTCHAs aceitos pelo site viram amostras rotuladas (mesmo formato de cvm_treino),
+# usadas também pelo classificador; recusados e sem leitura vão para revisão manual
+COLETAR_CAPTCHAS = True
+PASTA_COLETA = "cvm_coletado"
+PASTA_REVISAO = os.path.join(PASTA_COLETA, "revisao")
+# Um em cada PROPORCAO_VALIDACAO CAPTCHAs aceitos (escolhido pelo hash da imagem) vai
+# para cvm_coletado/validacao/, fora do treino: é o que o benchmark e o
+# reprocessamento usam como rótulo nas imagens de captchas/
+PASTA_VALIDACAO = os.path.join(PASTA_COLETA, "validacao")
+PROPORCAO_VALIDACAO = 5
+# Rede convolucional de dígitos (NumPy), gerada pelo comando "treinar-cnn"
+ARQUIVO_CNN = os.path.join(PASTA_MODELOS, "cnn_digitos.npz")
+# A softmax da CNN é confiante demais: no benchmark (deixando a amostra de fora) as
+# leituras erradas tinham margem acima de 0.99, e imagens de ruído chegaram a 0.93. Por
+# isso a CNN só responde quando concorda com o knn e a menor margem entre o 1º e o 2º
+# dígito mais prováveis passa deste valor (nenhuma leitura errada nem de ruído passou).
+CONFIANCA_MINIMA_CNN = 0.95
+# Tempo máximo de cada etapa: o fluxo avança assim que a página chega ao estado esperado (s)
+TIMEOUT_CAPTCHA_S = 10
+TIMEOUT_RESULTADO_S = 15
+INTERVALO_VERIFICACAO_MS = 100
+# Esperas fixas antigas, usadas só quando não é possível observar o estado da página (ms)
+ESPERA_CAPTCHA_MS = 3000
+ESPERA_RESULTADO_MS = 5000
+# Sessões do Chrome em paralelo no modo headless
+NUM_WORKERS = 1
+# Sessões extras abertas em segundo plano para substituir na hora uma sessão reciclada
+# ou caída. Cada sessão é reciclada depois de PAGINAS_POR_NAVEGADOR empresas ou se a
+# memória do Chrome (RSS com os subprocessos, medida com psutil) passar do limite.
+NAVEGADORES_RESERVA = 1
+PAGINAS_POR_NAVEGADOR = 200
+MEMORIA_MAXIMA_NAVEGADOR_MB = 1500
+# Navegador enxuto: carregamento "eager" (o fluxo já espera o CAPTCHA e os links) e
+# bloqueio, pelo DevTools, de CSS, fontes, imagens e rastreadores da página. Padrões que
+# bloqueariam o CAPTCHA (CAMINHO_CAPTCHA no host do link) são ignorados. Cada sessão usa uma pasta de
+# cache em disco dentro de PASTA_CACHE_CHROME, reaproveitada entre execuções.
+NAVEGADOR_ENXUTO = True
+RECURSOS_BLOQUEADOS = [
+    "*.css", "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.ico", "*.webp",
+    "*google-analytics.com*", "*googletagmanager.com*",
+]
+PASTA_CACHE_CHROME = "chrome_cache"
+# Vezes que uma empresa é refeita em outra sessão se o Chrome cair no meio dela
+TENTATIVAS_SESSAO = 2
+TIMEOUT_NAVEGADOR_S = 120
+# Motor HTTP (sem navegador)
+TIMEOUT_HTTP_S = 30
+# Download dos PDFs: streaming em blocos, (conexão, leitura) em segundos
+TIMEOUT_DOWNLOAD_S = (10, 60)
+TAMANHO_BLOCO_DOWNLOAD = 64 * 1024
+TAMANHO_MINIMO_PDF = 1000
+# Quedas de conexão no meio do PDF: novas tentativas retomam com Range a partir do .part
+TENTATIVAS_DOWNLOAD = 3
+INTERVALO_ESTADO_DOWNLOAD = 1024 * 1024
+USER_AGENT_HTTP = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0 Safari/537.36"
 
 # === PREPARO ===
-os.makedirs(PASTA_FORMULARIOS, exist_ok=True)
-os.makedirs(PASTA_CAPTCHAS, exist_ok=True)
-df = pd.read_excel(ARQUIVO_PLANILHA, header=None)
-names_links = df[0].tolist()
-companies = [(names_links[i], names_links[i+1]) for i in range(0, len(names_links)-1, 2)]
+def usar_pasta_saida(pasta):
+    global ARQUIVO_LOG, ARQUIVO_BANCO, PASTA_FORMULARIOS, PASTA_CAPTCHAS, ARQUIVO_HTML_DIAGNOSTICO
+    os.makedirs(pasta, exist_ok=True)
+    ARQUIVO_LOG = os.path.join(pasta, os.path.basename(ARQUIVO_LOG))
+    ARQUIVO_BANCO = os.path.join(pasta, os.path.basename(ARQUIVO_BANCO))
+    PASTA_FORMULARIOS = os.path.join(pasta, os.path.basename(PASTA_FORMULARIOS))
+    PASTA_CAPTCHAS = os.path.join(pasta, os.path.basename(PASTA_CAPTCHAS))
+    ARQUIVO_HTML_DIAGNOSTICO = os.path.join(pasta, os.path.basename(ARQUIVO_HTML_DIAGNOSTICO))
+
+def preparar_pastas():
+    os.makedirs(PASTA_FORMULARIOS, exist_ok=True)
+    os.makedirs(PASTA_CAPTCHAS, exist_ok=True)
+
+def ler_planilha(arquivo):
+    # Streaming (openpyxl read_only), só a coluna A da primeira aba: nome, link, nome, link...
+    import openpyxl  # só quando o cache está desatualizado
+    livro = openpyxl.load_workbook(arquivo, read_only=True)
+    try:
+        valores = [linha[0] if linha else None for linha in livro.worksheets[0].iter_rows(max_col=1, values_only=True)]
+    finally:
+        livro.close()
+    while valores and valores[-1] is None:
+        valores.pop()  # linhas vazias no fim da aba
+    valores = [str(v) if v is not None else None for v in valores]
+    return [(valores[i], valores[i+1]) for i in range(0, len(valores)-1, 2)]
+
+def empresas_da_planilha(arquivo=ARQUIVO_PLANILHA):
+    # Pares (nome, link) guardados em <planilha>.cache.json. Mesmo mtime e tamanho: usa o
+    # cache direto; senão compara o hash e só relê a planilha se o conteúdo mudou.
+    caminho_cache = os.path.splitext(arquivo)[0] + ".cache.json"
+    info = os.stat(arquivo)
+    assinatura = [info.st_mtime_ns, info.st_size]
+    try:
+        with open(caminho_cache, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    if cache.get("assinatura") != assinatura or "empresas" not in cache:
+        with open(arquivo, "rb") as f:
+            hash_planilha = hashlib.sha256(f.read()).hexdigest()
+        if cache.get("sha256") != hash_planilha or "empresas" not in cache:
+            cache["empresas"] = ler_planilha(arquivo)
+        cache.update(assinatura=assinatura, sha256=hash_planilha)
+        try:
+            with open(caminho_cache + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(cache, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(caminho_cache + ".tmp", caminho_cache)
+        except OSError:
+            pass  # pasta sem permissão de escrita: funciona, só sem cache
+    return [tuple(par) for par in cache["empresas"]]
+
+def carregar_empresas(arquivo=ARQUIVO_PLANILHA):
+    empresas = empresas_da_planilha(arquivo)
+    # Participantes repetidos na planilha custariam um CAPTCHA a mais cada
+    indice_empresas.clear()
+    for nome, link in empresas:
+        indice_empresas.setdefault(chave_empresa(link, nome), (nome, link))
+    return list(indice_empresas.values())
+
+# === INICIALIZAÇÃO ===
+# Marcos em ms desde o início do script (primeira ocorrência de cada etapa). Com
+# --medir-inicializacao a execução para na primeira navegação e imprime os marcos;
+# o comando benchmark-inicializacao roda o script assim várias vezes.
+marcos_inicializacao = {}
+medir_inicializacao = False
+
+def marcar_inicializacao(marco):
+    if marco not in marcos_inicializacao:
+        marcos_inicializacao[marco] = (time.perf_counter() - INICIO_PROCESSO) * 1000
+
+def executar_benchmark_inicializacao(args):
+    comando = [sys.executable, os.path.abspath(__file__), "--medir-inicializacao"]
+    if args.modo == "headless":
+        comando += ["headless", "--motor", args.motor] + (["--servidor", args.servidor] if args.servidor else [])
+    execucoes = []
+    for i in range(args.repeticoes):
+        inicio = time.perf_counter()
+        resultado = subprocess.run(comando, capture_output=True, text=True, encoding="utf-8", errors="replace")
+        linha = next((l for l in resultado.stdout.splitlines() if l.startswith("MARCOS_INICIALIZACAO ")), None)
+        if linha is None:
+            print(f"Execução {i+1} não chegou à primeira navegação (código {resultado.returncode}):")
+            print((resultado.stderr or resultado.stdout).strip()[-2000:])
+            return 1
+        marcos = json.loads(linha.split(" ", 1)[1])
+        marcos["processo"] = (time.perf_counter() - inicio) * 1000  # inclui subir e encerrar o Python
+        execucoes.append(marcos)
+        print(f"Execução {i+1}: " + " | ".join(f"{m} {v:.0f} ms" for m, v in marcos.items()), flush=True)
+    nomes = sorted({m for marcos in execucoes for m in marcos}, key=lambda m: np.median([e.get(m, np.inf) for e in execucoes]))
+    print(f"{'marco':<14}{'mediana ms':>12}{'mín ms':>10}{'máx ms':>10}")
+    for marco in nomes:
+        valores = [e[marco] for e in execucoes if marco in e]
+        print(f"{marco:<14}{np.median(valores):>12.0f}{min(valores):>10.0f}{max(valores):>10.0f}")
+    return 0
 
 # === HTML DIAGNÓSTICO ===
-with open(ARQUIVO_HTML_DIAGNOSTICO, "w", encoding="utf-8") as f:
-    f.write("""
+def iniciar_html_diagnostico():
+    with open(ARQUIVO_HTML_DIAGNOSTICO, "w", encoding="utf-8") as f:
+        f.write("""
     <html><head><title>Diagnóstico OCR</title>
     <style>
     body { font-family: Arial; background: #1e1e1e; color: #f0f0f0; }
@@ -47,7 +282,12 @@ with open(ARQUIVO_HTML_DIAGNOSTICO, "w", encoding="utf-8") as f:
     </head><body><h1>Resultados OCR</h1><ul>
     """)
 
-total = len(companies)
+def finalizar_html_diagnostico():
+    with open(ARQUIVO_HTML_DIAGNOSTICO, "a", encoding="utf-8") as html:
+        html.write("</ul></body></html>")
+
+companies = []
+total = 0
 atual = 0
 sucesso = 0
 falha = 0
@@ -55,15 +295,235 @@ ocr_ativo = False
 tempo_inicio = None
 tempo_medio_por_item = None
 
+# GUI (None quando executando em modo headless)
+root = None
+
 # === BROWSER ===
-options = uc.ChromeOptions()
-driver = uc.Chrome(options=options)
+driver = None
+
+# O uc corrige o binário do chromedriver ao iniciar; inicializações simultâneas conflitam
+lock_driver = threading.Lock()
+
+# Pastas de cache em uso: duas sessões ao mesmo tempo não podem dividir a mesma
+caches_chrome_em_uso = set()
+lock_caches_chrome = threading.Lock()
+
+def reservar_cache_chrome():
+    with lock_caches_chrome:
+        slot = 0
+        while slot in caches_chrome_em_uso:
+            slot += 1
+        caches_chrome_em_uso.add(slot)
+    return slot
+
+def padroes_bloqueio(link):
+    # "Allowlist" do CAPTCHA: fica de fora qualquer padrão que casaria com a URL dele
+    # a partir deste link (com --servidor, no host de teste), inclusive já renovado
+    captcha = urllib.parse.urljoin(link, CAMINHO_CAPTCHA)
+    captchas = [captcha, captcha + "?_=0"]
+    return [p for p in RECURSOS_BLOQUEADOS if not any(fnmatch.fnmatchcase(url, p) for url in captchas)]
+
+def bloquear_recursos(driver, link):
+    # Chamado antes de cada navegação; o DevTools só é acionado quando a URL do CAPTCHA muda
+    if not NAVEGADOR_ENXUTO:
+        return
+    captcha = urllib.parse.urljoin(link, CAMINHO_CAPTCHA)
+    if getattr(driver, "captcha_bloqueio", None) != captcha:
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": padroes_bloqueio(link)})
+        driver.captcha_bloqueio = captcha
+
+def criar_driver(headless=False):
+    options = uc.ChromeOptions()
+    if headless:
+        # Necessário para rodar em servidores Linux / containers sem display
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+    slot = None
+    if NAVEGADOR_ENXUTO:
+        options.page_load_strategy = "eager"
+        slot = reservar_cache_chrome()
+        options.add_argument(f"--disk-cache-dir={os.path.abspath(os.path.join(PASTA_CACHE_CHROME, str(slot)))}")
+    try:
+        with lock_driver:
+            novo = uc.Chrome(options=options, headless=headless)
+    except Exception:
+        with lock_caches_chrome:
+            caches_chrome_em_uso.discard(slot)
+        raise
+    novo.cache_chrome = slot
+    if NAVEGADOR_ENXUTO:
+        try:
+            novo.execute_cdp_cmd("Network.enable", {})
+        except Exception:
+            encerrar_driver(novo)
+            raise
+    marcar_inicializacao("driver")
+    return novo
+
+# O primeiro Chrome abre em segundo plano enquanto planilha, banco e janela (ou a fila
+# do modo headless) são preparados; o primeiro pedido de driver fica com ele
+driver_antecipado = None
+lock_driver_antecipado = threading.Lock()
+
+def antecipar_driver(headless=False):
+    global driver_antecipado
+    executor = ThreadPoolExecutor(1, thread_name_prefix="chrome")
+    driver_antecipado = executor.submit(criar_driver, headless)
+    executor.shutdown(wait=False)
+
+def driver_antecipado_pronto():
+    return driver_antecipado is None or driver_antecipado.done()
+
+def obter_driver(headless=False):
+    global driver_antecipado
+    with lock_driver_antecipado:
+        futuro, driver_antecipado = driver_antecipado, None
+    return futuro.result() if futuro is not None else criar_driver(headless)
+
+def descartar_driver_antecipado():
+    # Chrome antecipado que ninguém usou (ex.: nada pendente no modo headless)
+    global driver_antecipado
+    with lock_driver_antecipado:
+        futuro, driver_antecipado = driver_antecipado, None
+    if futuro is not None:
+        try:
+            encerrar_driver(futuro.result())
+        except Exception:
+            pass
+
+def encerrar_driver(driver):
+    try:
+        driver.quit()
+    except Exception:
+        pass
+    with lock_caches_chrome:
+        caches_chrome_em_uso.discard(getattr(driver, "cache_chrome", None))
+
+def navegador_vivo(driver):
+    try:
+        return driver.execute_script("return 1;") == 1
+    except Exception:
+        return False
+
+def memoria_navegador_mb(driver):
+    # RSS do Chrome e dos seus subprocessos (renderizadores, GPU); None sem psutil
+    pid = getattr(driver, "browser_pid", None)
+    if psutil is None or pid is None:
+        return None
+    try:
+        processo = psutil.Process(pid)
+        return sum(p.memory_info().rss for p in [processo] + processo.children(recursive=True)) / (1024 * 1024)
+    except psutil.Error:
+        return None
+
+class SessaoPerdida(Exception):
+    # O Chrome parou de responder no meio de uma empresa: ela é refeita em outra sessão
+    pass
+
+class GerenciadorNavegadores:
+    # Sessões Chrome do modo headless. Mantém reservas abertas em segundo plano, verifica
+    # a sessão de cada worker entre empresas e a troca quando caiu, atingiu
+    # PAGINAS_POR_NAVEGADOR ou passou de MEMORIA_MAXIMA_NAVEGADOR_MB.
+    def __init__(self, headless=True, reservas=NAVEGADORES_RESERVA):
+        self.headless = headless
+        self.reservas = reservas
+        self.prontos = Queue()  # sessões abertas à espera de um worker (None = falha ao abrir)
+        self.paginas = {}  # id(driver) -> empresas processadas
+        self.abrindo = 0
+        self.esperando = 0
+        self.encerrado = False
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(thread_name_prefix="chrome")
+
+    def _abrir(self):
+        try:
+            driver = obter_driver(self.headless)
+        except Exception as e:
+            print(f"Falha ao abrir o Chrome: {e}", flush=True)
+            driver = None
+        with self.lock:
+            self.abrindo -= 1
+            encerrado = self.encerrado
+        if encerrado and driver is not None:
+            encerrar_driver(driver)
+        else:
+            self.prontos.put(driver)
+
+    def _repor(self):
+        # Abre o que falta para atender quem está esperando e manter as reservas
+        with self.lock:
+            if self.encerrado:
+                return
+            faltam = max(self.esperando + self.reservas - self.prontos.qsize() - self.abrindo, 0)
+            self.abrindo += faltam
+        for _ in range(faltam):
+            self.executor.submit(self._abrir)
+
+    def obter(self):
+        with self.lock:
+            self.esperando += 1
+        try:
+            self._repor()
+            driver = self.prontos.get(timeout=TIMEOUT_NAVEGADOR_S)
+        except Empty:
+            driver = None
+        finally:
+            with self.lock:
+                self.esperando -= 1
+        self._repor()  # repõe a reserva que acabou de ser usada
+        if driver is None:
+            raise RuntimeError("não foi possível abrir o Chrome")
+        self.paginas[id(driver)] = 0
+        return driver
+
+    def motivo_reciclagem(self, driver):
+        if not navegador_vivo(driver):
+            return "não responde"
+        if self.paginas.get(id(driver), 0) >= PAGINAS_POR_NAVEGADOR:
+            return f"{PAGINAS_POR_NAVEGADOR} empresas"
+        memoria = memoria_navegador_mb(driver)
+        if memoria is not None and memoria > MEMORIA_MAXIMA_NAVEGADOR_MB:
+            return f"{memoria:.0f} MB"
+        return None
+
+    def preparar(self, driver):
+        # Entre empresas: mantém a sessão se estiver saudável; senão troca por uma pronta
+        if driver is not None:
+            motivo = self.motivo_reciclagem(driver)
+            if motivo is None:
+                self.paginas[id(driver)] += 1
+                return driver
+            print(f"{threading.current_thread().name}: reciclando o Chrome ({motivo})", flush=True)
+            self.descartar(driver)
+        driver = self.obter()
+        self.paginas[id(driver)] += 1
+        return driver
+
+    def descartar(self, driver):
+        # O quit pode levar segundos: roda fora do worker
+        self.paginas.pop(id(driver), None)
+        self.executor.submit(encerrar_driver, driver)
+
+    def encerrar(self):
+        with self.lock:
+            self.encerrado = True
+        while True:
+            try:
+                driver = self.prontos.get_nowait()
+            except Empty:
+                break
+            if driver is not None:
+                self.executor.submit(encerrar_driver, driver)
+        self.executor.shutdown(wait=True)
 
 # === LOG ===
 # Set para empresas que já tiveram falha única
 empresas_falha = set()
 # Set para empresas sem formulário
 empresas_sem_formulario = set()
+# Empresas registradas no log nesta execução (progresso do modo headless)
+concluidos = 0
+lock_registro = threading.Lock()
 
 def normalizar_nome(nome):
     nome = nome.strip().lower()
@@ -71,42 +531,245 @@ def normalizar_nome(nome):
     nome = ''.join([c for c in nome if not unicodedata.combining(c)])
     return nome
 
-def registrar_log(nome, status, arquivo, texto=""):
-    global sucesso, falha
-    horario = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    linha = f"[{horario}] {nome} | {status} | {arquivo}\n"
-    with open(ARQUIVO_LOG, "a", encoding="utf-8") as f:
-        f.write(linha)
+# === CHAVE DA EMPRESA ===
+# chave -> (nome, link) das empresas da planilha
+indice_empresas = {}
+
+def chave_empresa(link, nome=""):
+    # Identificador estável do participante, tirado do link: "<Tipo_Partic>-<Cpfcgc_Partic>".
+    # Usado no nome dos arquivos, no log, no banco e para deduplicar/retomar.
+    params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(str(link)).query))
+    cpfcgc = "".join(filter(str.isdigit, params.get("Cpfcgc_Partic", "")))
+    if cpfcgc:
+        tipo = "".join(filter(str.isdigit, params.get("Tipo_Partic", "")))
+        return f"{tipo}-{cpfcgc}" if tipo else cpfcgc
+    return normalizar_nome(nome)
+
+def nome_legado(nome):
+    # Nome de arquivo usado até a versão 1.8 (sem a chave)
+    return nome.strip().replace(' ', '_').replace('/', '_')
+
+# === ESTADO (SQLite) ===
+# Uma linha por empresa (situação atual) + histórico de tentativas. Substitui a
+# releitura do resultado_extracao.log e da pasta de formulários a cada início.
+banco = None
+
+ESQUEMA_BANCO = """
+CREATE TABLE IF NOT EXISTS empresas (
+    chave TEXT PRIMARY KEY,
+    nome TEXT NOT NULL,
+    situacao TEXT NOT NULL,
+    ultimo_status TEXT,
+    arquivo TEXT,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    atualizado_em TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_empresas_situacao ON empresas(situacao);
+CREATE TABLE IF NOT EXISTS tentativas (
+    id INTEGER PRIMARY KEY,
+    chave TEXT NOT NULL REFERENCES empresas(chave),
+    horario TEXT NOT NULL,
+    status TEXT NOT NULL,
+    arquivo TEXT,
+    texto TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tentativas_chave ON tentativas(chave);
+CREATE TABLE IF NOT EXISTS psm_estatisticas (
+    psm INTEGER PRIMARY KEY,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    acertos INTEGER NOT NULL DEFAULT 0
+);
+-- Uma linha por (variante, amostra): rodar o benchmark de novo substitui o resultado da amostra
+CREATE TABLE IF NOT EXISTS variantes_avaliacoes (
+    variante TEXT NOT NULL,
+    amostra TEXT NOT NULL,
+    acerto INTEGER NOT NULL,
+    PRIMARY KEY (variante, amostra)
+);
+"""
 
-    style = "success" if "Baixado" in status else "fail"
-    nome_empresa = normalizar_nome(nome)
-    if "Baixado" in status:
-        sucesso += 1
-    elif status == "Sem Formulário":
-        if nome_empresa not in empresas_sem_formulario:
-            empresas_sem_formulario.add(nome_empresa)
-    else:
-        if nome_empresa not in empresas_falha and nome_empresa not in empresas_sem_formulario:
-            falha += 1
-            empresas_falha.add(nome_empresa)
+# Situação nunca regride: baixado > sem_formulario > falha/pulado
+SQL_REGISTRAR_EMPRESA = """
+INSERT INTO empresas (chave, nome, situacao, ultimo_status, arquivo, tentativas, atualizado_em)
+VALUES (?, ?, ?, ?, ?, 1, ?)
+ON CONFLICT(chave) DO UPDATE SET
+    nome = excluded.nome,
+    ultimo_status = excluded.ultimo_status,
+    tentativas = empresas.tentativas + 1,
+    atualizado_em = excluded.atualizado_em,
+    arquivo = CASE WHEN excluded.arquivo != '' THEN excluded.arquivo ELSE empresas.arquivo END,
+    situacao = CASE
+        WHEN 'baixado' IN (empresas.situacao, excluded.situacao) THEN 'baixado'
+        WHEN 'sem_formulario' IN (empresas.situacao, excluded.situacao) THEN 'sem_formulario'
+        ELSE excluded.situacao
+    END
+"""
 
-    with open(ARQUIVO_HTML_DIAGNOSTICO, "a", encoding="utf-8") as html:
-        html.write(f"<li class='{style}'><strong>{nome}</strong><br>Status: {status}<br>Arquivo: {arquivo if arquivo else 'N/A'}<br>Texto OCR: {texto}<br>")
-        nome_base = nome.strip().replace(' ', '_').replace('/', '_')
-        processado_path = os.path.join(PASTA_CAPTCHAS, f"{nome_base}_processado.png")
-        original_path = os.path.join(PASTA_CAPTCHAS, f"{nome_base}_original.png")
-        rel_proc = os.path.relpath(processado_path).replace('\\', '/')
-        rel_orig = os.path.relpath(original_path).replace('\\', '/')
-        if os.path.exists(processado_path):
-            html.write(f"<b>Processado:</b><br><img src='{rel_proc}' height='60'><br>")
+def situacao_do_status(status):
+    if "Baixado" in status:
+        return "baixado"
+    if status == "Sem Formulário":
+        return "sem_formulario"
+    if status.startswith("Pulado"):
+        return "pulado"
+    return "falha"
+
+# psm -> (tentativas, acertos), espelho em memória da tabela psm_estatisticas
+estatisticas_psm = {}
+# variante -> (amostras avaliadas, acertos), resumo em memória da tabela variantes_avaliacoes
+estatisticas_variantes = {}
+
+# Versão 2: chave = chave_empresa() (antes era o nome normalizado)
+VERSAO_BANCO = 2
+
+def abrir_banco(caminho=None):
+    global banco
+    caminho = caminho or ARQUIVO_BANCO
+    # Uma conexão compartilhada; todas as escritas acontecem sob lock_registro
+    banco = sqlite3.connect(caminho, check_same_thread=False)
+    banco.execute("PRAGMA journal_mode=WAL")
+    banco.execute("PRAGMA synchronous=NORMAL")
+    if banco.execute("PRAGMA user_version").fetchone()[0] < VERSAO_BANCO:
+        # Chaves antigas não batem com as novas: reconstrói a partir do log
+        banco.executescript("DROP TABLE IF EXISTS tentativas; DROP TABLE IF EXISTS empresas;")
+        banco.execute(f"PRAGMA user_version = {VERSAO_BANCO}")
+    banco.executescript(ESQUEMA_BANCO)
+    if banco.execute("SELECT COUNT(*) FROM empresas").fetchone()[0] == 0:
+        importar_historico()
+    estatisticas_psm.update({psm: (t, a) for psm, t, a in banco.execute("SELECT psm, tentativas, acertos FROM psm_estatisticas")})
+    carregar_estatisticas_variantes()
+    return banco
+
+def carregar_estatisticas_variantes():
+    estatisticas_variantes.update({v: (n, a) for v, n, a in banco.execute(
+        "SELECT variante, COUNT(*), SUM(acerto) FROM variantes_avaliacoes GROUP BY variante")})
+
+def gravar_tentativas(registros):
+    # registros: (chave, nome, horario, status, arquivo, texto)
+    with banco:
+        for chave, nome, horario, status, arquivo, texto in registros:
+            banco.execute(SQL_REGISTRAR_EMPRESA, (chave, nome, situacao_do_status(status), status, arquivo or "", horario))
+            banco.execute("INSERT INTO tentativas (chave, horario, status, arquivo, texto) VALUES (?, ?, ?, ?, ?)",
+                          (chave, horario, status, arquivo or "", texto))
+
+def importar_historico():
+    # Migração única: resultado_extracao.log + PDFs já existentes em formularios/.
+    # Log e arquivos antigos só têm o nome; a chave vem da planilha.
+    chave_por_nome = {normalizar_nome(nome): chave for chave, (nome, _) in indice_empresas.items()}
+    chave_por_arquivo = {nome_legado(nome): chave for chave, (nome, _) in indice_empresas.items()}
+    registros = []
+    padrao = re.compile(r"^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\] (.+)$")
+    if os.path.exists(ARQUIVO_LOG):
+        with open(ARQUIVO_LOG, encoding="utf-8") as f:
+            for linha in f:
+                m = padrao.match(linha.rstrip("\n"))
+                if not m:
+                    continue  # continuação de stack trace
+                partes = m.group(2).split(" | ")
+                if len(partes) == 2:
+                    # Erro com várias linhas: o " | arquivo" só aparece depois do stack trace
+                    nome, status, arquivo = partes[0], partes[1], ""
+                elif len(partes) > 2:
+                    # O nome pode conter " | " (ex.: "(OVERCLUB | FAMILY OFFCIE)"); status e arquivo são os últimos campos
+                    nome, status, arquivo = " | ".join(partes[:-2]), partes[-2], partes[-1].strip()
+                else:
+                    continue
+                chave = chave_por_nome.get(normalizar_nome(nome), normalizar_nome(nome))
+                registros.append((chave, nome.strip(), m.group(1), status.strip(), arquivo, ""))
+    if os.path.isdir(PASTA_FORMULARIOS):
+        horario = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for arq in os.listdir(PASTA_FORMULARIOS):
+            if arq.lower().endswith(".pdf"):
+                base = arq.replace("_FORMULARIO.pdf", "")
+                if base in chave_por_arquivo:
+                    chave = chave_por_arquivo[base]
+                    nome = indice_empresas[chave][0]
+                else:
+                    nome = base.replace("_", " ")
+                    chave = chave_por_nome.get(normalizar_nome(nome), normalizar_nome(nome))
+                registros.append((chave, nome.strip(), horario, "Baixado", arq, "importado de formularios/"))
+    gravar_tentativas(registros)
+
+def registrar_resultado_psms(codigo, estado):
+    # Depois do envio: cada PSM que rodou neste CAPTCHA conta um acerto se leu o código
+    # aceito. Se o site recusou, só os PSMs que leram o código enviado contam (erro).
+    leituras = getattr(tesseract_local, "leituras", {})
+    tesseract_local.leituras = {}
+    if not codigo or estado not in ("formulario", "pagina", "captcha_recusado"):
+        return
+    aceito = estado != "captcha_recusado"
+    with lock_registro:
+        with banco:
+            for psm, digitos in leituras.items():
+                acerto = aceito and digitos == codigo
+                if not aceito and digitos != codigo:
+                    continue
+                banco.execute("INSERT INTO psm_estatisticas (psm, tentativas, acertos) VALUES (?, 1, ?) "
+                              "ON CONFLICT(psm) DO UPDATE SET tentativas = tentativas + 1, acertos = acertos + excluded.acertos",
+                              (psm, int(acerto)))
+                tentativas, acertos = estatisticas_psm.get(psm, (0, 0))
+                estatisticas_psm[psm] = (tentativas + 1, acertos + acerto)
+
+def registrar_avaliacao_variantes(leituras, amostra, label):
+    # Benchmark: cada variante lida acerta a amostra se leu o rótulo; uma avaliação
+    # anterior da mesma amostra é substituída
+    with lock_registro:
+        with banco:
+            banco.executemany("INSERT INTO variantes_avaliacoes (variante, amostra, acerto) VALUES (?, ?, ?) "
+                              "ON CONFLICT(variante, amostra) DO UPDATE SET acerto = excluded.acerto",
+                              [(variante, amostra, int(digitos == label)) for variante, digitos in leituras.items()])
+        carregar_estatisticas_variantes()
+
+def chaves_por_situacao(*situacoes):
+    marcadores = ", ".join("?" * len(situacoes))
+    with lock_registro:
+        cursor = banco.execute(f"SELECT chave FROM empresas WHERE situacao IN ({marcadores})", situacoes)
+        return {chave for (chave,) in cursor}
+
+def registrar_log(chave, nome, status, arquivo, texto=""):
+    global sucesso, falha, concluidos
+    # Chamado por vários workers ao mesmo tempo: contadores, log e HTML sob o mesmo lock
+    with lock_registro:
+        concluidos += 1
+        horario = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        linha = f"[{horario}] {nome} | {status} | {arquivo}\n"
+        with open(ARQUIVO_LOG, "a", encoding="utf-8") as f:
+            f.write(linha)
+        if banco is not None:
+            gravar_tentativas([(chave, nome.strip(), horario, status, arquivo, texto)])
+
+        style = "success" if "Baixado" in status else "fail"
+        if "Baixado" in status:
+            sucesso += 1
+        elif status == "Sem Formulário":
+            if chave not in empresas_sem_formulario:
+                empresas_sem_formulario.add(chave)
         else:
-            html.write("<b>Processado:</b> Imagem não disponível<br>")
-        if os.path.exists(original_path):
-            html.write(f"<b>Original:</b><br><img src='{rel_orig}' height='60'><br>")
+            if chave not in empresas_falha and chave not in empresas_sem_formulario:
+                falha += 1
+                empresas_falha.add(chave)
+
+        with open(ARQUIVO_HTML_DIAGNOSTICO, "a", encoding="utf-8") as html:
+            html.write(f"<li class='{style}'><strong>{nome}</strong><br>Status: {status}<br>Arquivo: {arquivo if arquivo else 'N/A'}<br>Texto OCR: {texto}<br>")
+            nome_base = nome_arquivo_base(chave, nome)
+            processado_path = os.path.join(PASTA_CAPTCHAS, f"{nome_base}_processado.png")
+            original_path = os.path.join(PASTA_CAPTCHAS, f"{nome_base}_original.png")
+            rel_proc = os.path.relpath(processado_path).replace('\\', '/')
+            rel_orig = os.path.relpath(original_path).replace('\\', '/')
+            if os.path.exists(processado_path):
+                html.write(f"<b>Processado:</b><br><img src='{rel_proc}' height='60'><br>")
+            else:
+                html.write("<b>Processado:</b> Imagem não disponível<br>")
+            if os.path.exists(original_path):
+                html.write(f"<b>Original:</b><br><img src='{rel_orig}' height='60'><br>")
+            else:
+                html.write("<b>Original:</b> Imagem não disponível<br>")
+            html.write("</li>")
+        if root is not None:
+            atualiza_log_temporario(status)
         else:
-            html.write("<b>Original:</b> Imagem não disponível<br>")
-        html.write("</li>")
-    atualiza_log_temporario(status)
+            print(f"[{concluidos}/{total}] {nome} | {status}", flush=True)
+
 
 # === FUNÇÕES ===
 def formatar_tempo(segundos):
@@ -130,23 +793,1266 @@ def atualizar_tempo_estimado():
         return formatar_tempo(tempo_restante)
     return "Calculando..."
 
+# === PIPELINE (sem GUI) ===
+def nome_arquivo_base(chave, nome):
+    # A chave garante unicidade; o nome fica só para leitura humana
+    return re.sub(r'[\s/\\:*?"<>|]+', '_', f"{chave}_{nome.strip()}")
+
+def ampliar_binaria(bin_img):
+    return Image.fromarray(cv2.resize(bin_img, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC))
+
+def aplicar_preprocessamento_opencv(image_pil):
+    image_np = np.array(image_pil.convert("L"))
+    _, bin_img = cv2.threshold(image_np, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    bin_img = cv2.bitwise_not(bin_img)
+    bin_img = cv2.medianBlur(bin_img, 3)
+    return ampliar_binaria(bin_img)
+
+# --- Variantes de pré-processamento ---
+# Todas devolvem o mesmo formato de aplicar_preprocessamento_opencv (dígitos brancos
+# em fundo preto, escala 2x); o backend "tesseract-variantes" lê cada uma e vota.
+def preprocessamento_adaptativo(image_pil):
+    # Limiar por vizinhança: aguenta fundo com gradiente, onde um limiar global (Otsu) falha
+    image_np = np.array(image_pil.convert("L"))
+    bin_img = cv2.adaptiveThreshold(image_np, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 15, 8)
+    return ampliar_binaria(cv2.medianBlur(bin_img, 3))
+
+def preprocessamento_morfologia(image_pil):
+    # Fechamento com kernel 2x2: reconecta traços quebrados pelo ruído
+    image_np = np.array(image_pil.convert("L"))
+    _, bin_img = cv2.threshold(image_np, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2, 2))
+    return ampliar_binaria(cv2.morphologyEx(bin_img, cv2.MORPH_CLOSE, kernel))
+
+def preprocessamento_denoise(image_pil):
+    # Remove o ruído em tons de cinza antes do limiar, em vez de filtrar a imagem binária
+    image_np = cv2.fastNlMeansDenoising(np.array(image_pil.convert("L")), None, h=15)
+    _, bin_img = cv2.threshold(image_np, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return ampliar_binaria(bin_img)
+
+def preprocessamento_recorte(image_pil, margem=6):
+    # Recorta a imagem padrão no retângulo que contém os dígitos
+    bin_img = np.array(aplicar_preprocessamento_opencv(image_pil))
+    ys, xs = np.nonzero(bin_img > 127)
+    if not len(xs):
+        return Image.fromarray(bin_img)
+    return Image.fromarray(bin_img[max(ys.min() - margem, 0):ys.max() + margem + 1,
+                                   max(xs.min() - margem, 0):xs.max() + margem + 1])
+
+VARIANTES_PREPROCESSAMENTO = {
+    "opencv": aplicar_preprocessamento_opencv,
+    "adaptativo": preprocessamento_adaptativo,
+    "morfologia": preprocessamento_morfologia,
+    "denoise": preprocessamento_denoise,
+    "recorte": preprocessamento_recorte,
+}
+
+# --- Sonda da página: cada verificação é um único execute_script ---
+# Retorna um retrato do estado da página em vez de vários find_element/get_attribute
+# (cada um é uma ida e volta ao chromedriver):
+#   pronta: document.readyState == "complete"
+#   enviada: ainda é o documento em que enviar_captcha() enviou o código
+#   captcha_src / captcha_carregado: <img> do CAPTCHA (src absoluto) e se já carregou
+#   formularios: hrefs absolutos dos links "Formulário de Referência"
+JS_SONDAR_PAGINA = """
+const [xpath, textoLink] = arguments;
+const img = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+return {
+    pronta: document.readyState === "complete",
+    enviada: document.envioCaptcha === true,
+    captcha_src: img ? img.src : null,
+    captcha_carregado: !!(img && img.complete && img.naturalWidth > 0),
+    formularios: Array.from(document.links)
+        .filter(a => a.textContent.replace(/\\s+/g, " ").includes(textoLink))
+        .map(a => a.href),
+};
+"""
+
+def sondar_pagina(driver):
+    return driver.execute_script(JS_SONDAR_PAGINA, XPATH_CAPTCHA, TEXTO_LINK_FORMULARIO)
+
+# --- Estados da página (verificações não bloqueantes) ---
+def captcha_carregado(driver):
+    # Retorna a sonda quando a imagem do CAPTCHA terminou de carregar
+    sonda = sondar_pagina(driver)
+    return sonda if sonda["captcha_carregado"] else None
+
+def estado_resultado(driver):
+    # Após o envio: "formulario", "captcha_recusado" (CAPTCHA exibido de novo) ou "pagina"
+    sonda = sondar_pagina(driver)
+    if sonda["formularios"]:
+        return "formulario"
+    if sonda["enviada"] or not sonda["pronta"]:
+        return None  # ainda na página do envio, ou a próxima ainda carregando
+    if sonda["captcha_src"]:
+        return "captcha_recusado"
+    return "pagina"
+
+def aguardar_estado(verificar, timeout_s, espera_fallback_ms=0, fallback=None):
+    # Versão bloqueante (headless); retorna None se o tempo esgotar
+    limite = time.monotonic() + timeout_s
+    while True:
+        try:
+            resultado = verificar()
+        except (StaleElementReferenceException, NoSuchElementException, JavascriptException):
+            resultado = None  # página em transição (script interrompido pela navegação)
+        except WebDriverException:
+            # Não foi possível observar a página: volta à espera fixa
+            time.sleep(espera_fallback_ms / 1000)
+            return fallback() if fallback else None
+        if resultado or time.monotonic() >= limite:
+            return resultado
+        time.sleep(INTERVALO_VERIFICACAO_MS / 1000)
+
+def primeiro_captcha(driver):
+    # Fallback sem a sonda: só confirma que o <img> existe
+    elems = driver.find_elements(By.XPATH, XPATH_CAPTCHA)
+    return {"captcha_src": elems[0].get_attribute("src"), "captcha_carregado": False} if elems else None
+
+def localizar_captcha(driver, timeout=TIMEOUT_CAPTCHA_S):
+    return aguardar_estado(lambda: captcha_carregado(driver), timeout, ESPERA_CAPTCHA_MS,
+                           fallback=lambda: primeiro_captcha(driver))
+
+# Pixels da imagem no tamanho natural, do jeito que o servidor enviou: não depende de
+# DPI/zoom nem de renderização (como o screenshot do elemento) e não faz outra
+# requisição ao aspcaptcha.asp, o que trocaria o código guardado na sessão
+JS_IMAGEM_CAPTCHA = """
+const img = document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+if (!img || !img.complete || !img.naturalWidth) return null;
+const canvas = document.createElement("canvas");
+canvas.width = img.naturalWidth;
+canvas.height = img.naturalHeight;
+canvas.getContext("2d").drawImage(img, 0, 0);
+return canvas.toDataURL("image/png");
+"""
+
+def bytes_captcha(driver):
+    try:
+        data_url = driver.execute_script(JS_IMAGEM_CAPTCHA, XPATH_CAPTCHA)
+    except WebDriverException:
+        data_url = None  # canvas bloqueado (imagem de outra origem): volta ao screenshot
+    if data_url and data_url.startswith("data:image/png;base64,"):
+        return base64.b64decode(data_url.split(",", 1)[1])
+    return driver.find_element(By.XPATH, XPATH_CAPTCHA).screenshot_as_png
+
+# Pede outro CAPTCHA recarregando só o <img>; o parâmetro extra evita o cache e o
+# servidor gera um novo código na sessão, que passa a valer para o envio
+JS_RENOVAR_CAPTCHA = """
+const img = document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+if (!img) return false;
+const src = img.dataset.srcOriginal || (img.dataset.srcOriginal = img.src);
+img.src = src + (src.includes("?") ? "&" : "?") + "_=" + Date.now();
+return true;
+"""
+
+def pedir_novo_captcha(driver):
+    try:
+        renovado = driver.execute_script(JS_RENOVAR_CAPTCHA, XPATH_CAPTCHA)
+    except WebDriverException:
+        renovado = False
+    if not renovado:
+        driver.refresh()  # elemento sumiu ou script bloqueado: recarrega a página inteira
+
+def renovar_captcha(driver):
+    pedir_novo_captcha(driver)
+    return localizar_captcha(driver)
+
+def capturar_captcha(driver, chave, nome):
+    png_data = bytes_captcha(driver)
+    return salvar_captcha(PILImage.open(BytesIO(png_data)), chave, nome)
+
+def salvar_captcha(image, chave, nome):
+    nome_base = nome_arquivo_base(chave, nome)
+    original_path = os.path.join(PASTA_CAPTCHAS, f"{nome_base}_original.png")
+    image.save(original_path)
+
+    image_proc = aplicar_preprocessamento_opencv(image)
+    processado_path = os.path.join(PASTA_CAPTCHAS, f"{nome_base}_processado.png")
+    image_proc.save(processado_path)
+    return image, image_proc, processado_path
+
+# --- Classificador de dígitos (NumPy) ---
+# O CAPTCHA tem sempre 4 dígitos da mesma fonte: a imagem binarizada é separada em
+# blobs e cada dígito é comparado (correlação, vizinho mais próximo) com os dígitos
+# das amostras rotuladas, os 4 numa única multiplicação de matrizes.
+TAMANHO_DIGITO = (12, 16)  # largura, altura
+
+def caixas_digitos(binaria, quantidade=4, area_minima=12):
+    # Retorna [(x0, x1, y0, y1)] de cada dígito, da esquerda para a direita, ou None
+    n, _, stats, _ = cv2.connectedComponentsWithStats(binaria, connectivity=8)
+    faixas = sorted([int(x), int(x + w)] for x, _, w, _, area in stats[1:] if area >= area_minima)
+
+    # Pedaços do mesmo dígito (sobreposição horizontal grande) viram uma faixa só
+    blobs = []
+    for x0, x1 in faixas:
+        if blobs:
+            sobreposicao = min(x1, blobs[-1][1]) - max(x0, blobs[-1][0])
+            if sobreposicao > 0.5 * min(x1 - x0, blobs[-1][1] - blobs[-1][0]):
+                blobs[-1] = [min(x0, blobs[-1][0]), max(x1, blobs[-1][1])]
+                continue
+        blobs.append([x0, x1])
+
+    # Dígitos encostados: divide a faixa mais larga na coluna com menos tinta
+    colunas = binaria.sum(axis=0)
+    while 0 < len(blobs) < quantidade:
+        i = max(range(len(blobs)), key=lambda j: blobs[j][1] - blobs[j][0])
+        x0, x1 = blobs[i]
+        if x1 - x0 < 6:
+            return None
+        margem = (x1 - x0) // 4
+        corte = x0 + margem + int(np.argmin(colunas[x0 + margem:x1 - margem]))
+        blobs[i:i + 1] = [[x0, corte], [corte, x1]]
+
+    # Sobrou ruído: junta a faixa mais estreita com a vizinha mais próxima
+    while len(blobs) > quantidade:
+        i = min(range(len(blobs)), key=lambda j: blobs[j][1] - blobs[j][0])
+        if i == len(blobs) - 1 or (i > 0 and blobs[i][0] - blobs[i - 1][1] < blobs[i + 1][0] - blobs[i][1]):
+            i -= 1
+        blobs[i:i + 2] = [[blobs[i][0], blobs[i + 1][1]]]
+
+    if len(blobs) != quantidade:
+        return None
+    caixas = []
+    for x0, x1 in blobs:
+        linhas = np.flatnonzero(binaria[:, x0:x1].any(axis=1))
+        if not len(linhas):
+            return None
+        caixas.append((x0, x1, int(linhas[0]), int(linhas[-1]) + 1))
+    return caixas
+
+def segmentar_digitos(image_proc, quantidade=4, area_minima=12):
+    binaria = (np.asarray(image_proc) > 127).astype(np.uint8)
+    caixas = caixas_digitos(binaria, quantidade, area_minima)
+    if caixas is None:
+        return None
+    vetores = []
+    for x0, x1, y0, y1 in caixas:
+        recorte = binaria[y0:y1, x0:x1].astype(np.float32)
+        vetores.append(cv2.resize(recorte, TAMANHO_DIGITO, interpolation=cv2.INTER_AREA).ravel())
+    return np.array(vetores)
+
+def normalizar_vetores(vetores):
+    centrados = vetores - vetores.mean(axis=1, keepdims=True)
+    return centrados / np.maximum(np.linalg.norm(centrados, axis=1, keepdims=True), 1e-6)
+
+def variacoes_digito(vetor):
+    # Deslocamentos de 1 px e rotações leves, para compensar a pouca quantidade de amostras
+    largura, altura = TAMANHO_DIGITO
+    digito = vetor.reshape(altura, largura)
+    variacoes = [vetor]
+    for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+        variacoes.append(np.roll(np.roll(digito, dx, axis=1), dy, axis=0).ravel())
+    for angulo in (-8, 8):
+        matriz = cv2.getRotationMatrix2D((largura / 2, altura / 2), angulo, 1)
+        variacoes.append(cv2.warpAffine(digito, matriz, (largura, altura)).ravel())
+    return variacoes
+
+def amostras_treino(pasta=PASTA_TREINO, arquivo_labels=ARQUIVO_LABELS_TREINO):
+    # labels.txt: linha i é o código da imagem NN.png
+    if not os.path.exists(arquivo_labels):
+        return []
+    with open(arquivo_labels, encoding="utf-8") as f:
+        labels = [linha.strip() for linha in f if linha.strip()]
+    amostras = []
+    for i, label in enumerate(labels, start=1):
+        caminho = os.path.join(pasta, f"{i:02d}.png")
+        if os.path.exists(caminho):
+            amostras.append((caminho, label))
+    return amostras
+
+def amostras_classificador():
+    # cvm_treino + CAPTCHAs coletados das execuções anteriores
+    return amostras_treino() + amostras_treino(os.path.join(PASTA_COLETA, "captchas"),
+                                               os.path.join(PASTA_COLETA, "labels.txt"))
+
+def treinar_classificador(amostras):
+    # amostras: [(caminho da imagem original, código de 4 dígitos)]
+    vetores, rotulos = [], []
+    for caminho, label in amostras:
+        digitos = segmentar_digitos(aplicar_preprocessamento_opencv(PILImage.open(caminho)))
+        if digitos is None or len(label) != len(digitos):
+            continue
+        for vetor, d in zip(digitos, label):
+            for variacao in variacoes_digito(vetor):
+                vetores.append(variacao)
+                rotulos.append(int(d))
+    if not vetores:
+        return np.zeros((0, TAMANHO_DIGITO[0] * TAMANHO_DIGITO[1]), np.float32), np.zeros(0, int)
+    return normalizar_vetores(np.array(vetores, np.float32)), np.array(rotulos)
+
+def classificar_digitos(image_proc, modelo):
+    # Retorna (dígitos, margem): margem é a menor distância entre o melhor dígito e o segundo
+    vetores = segmentar_digitos(image_proc)
+    modelo, rotulos = modelo
+    if vetores is None or not len(rotulos):
+        return "", 0.0
+    similaridade = normalizar_vetores(vetores) @ modelo.T  # (4, amostras)
+    por_classe = np.where(rotulos[None, None, :] == np.arange(10)[None, :, None],
+                          similaridade[:, None, :], -1.0).max(axis=2)  # (4, 10)
+    ordem = np.sort(por_classe, axis=1)
+    margem = float((ordem[:, -1] - ordem[:, -2]).min())
+    return "".join(str(d) for d in por_classe.argmax(axis=1)), margem
+
+# --- Rede convolucional de dígitos (NumPy) ---
+# conv 3x3 (8) -> ReLU -> max pool 2 -> conv 3x3 (16) -> ReLU -> max pool 2 -> densa (10),
+# sobre os mesmos recortes 16x12 de segmentar_digitos. Treino e inferência só com
+# NumPy; os pesos ficam num .npz. A inferência é em lote: os dígitos de vários
+# CAPTCHAs passam pela rede numa única chamada.
+def conv_3x3(x, pesos, bias):
+    # x: (N, H, W, C); pesos: (C, 3, 3, saídas); padding 1
+    janelas = np.lib.stride_tricks.sliding_window_view(np.pad(x, ((0, 0), (1, 1), (1, 1), (0, 0))), (3, 3), axis=(1, 2))
+    return np.einsum("nhwcij,cijo->nhwo", janelas, pesos, optimize=True) + bias, janelas
+
+def conv_3x3_gradiente(d_saida, janelas, pesos, formato_entrada):
+    d_pesos = np.einsum("nhwcij,nhwo->cijo", janelas, d_saida, optimize=True)
+    d_janelas = np.einsum("nhwo,cijo->nhwcij", d_saida, pesos, optimize=True)
+    n, h, w, c = formato_entrada
+    d_entrada = np.zeros((n, h + 2, w + 2, c), d_saida.dtype)
+    for i in range(3):
+        for j in range(3):
+            d_entrada[:, i:i + h, j:j + w, :] += d_janelas[..., i, j]
+    return d_entrada[:, 1:-1, 1:-1, :], d_pesos, d_saida.sum(axis=(0, 1, 2))
+
+def max_pool_2x2(x):
+    n, h, w, c = x.shape
+    blocos = x.reshape(n, h // 2, 2, w // 2, 2, c)
+    saida = blocos.max(axis=(2, 4))
+    return saida, blocos == saida[:, :, None, :, None, :]
+
+def cnn_propagar(pesos, x, guardar=False):
+    z1, janelas1 = conv_3x3(x, pesos["conv1_w"], pesos["conv1_b"])
+    a1 = np.maximum(z1, 0)
+    p1, mascara1 = max_pool_2x2(a1)
+    z2, janelas2 = conv_3x3(p1, pesos["conv2_w"], pesos["conv2_b"])
+    a2 = np.maximum(z2, 0)
+    p2, mascara2 = max_pool_2x2(a2)
+    planos = p2.reshape(len(x), -1)
+    logits = planos @ pesos["densa_w"] + pesos["densa_b"]
+    if not guardar:
+        return logits
+    return logits, (x, z1, janelas1, a1, mascara1, p1, z2, janelas2, a2, mascara2, p2, planos)
+
+def cnn_gradientes(pesos, x, y):
+    logits, (x, z1, janelas1, a1, mascara1, p1, z2, janelas2, a2, mascara2, p2, planos) = cnn_propagar(pesos, x, True)
+    probs = softmax(logits)
+    perda = float(-np.log(probs[np.arange(len(y)), y] + 1e-9).mean())
+    d_logits = probs
+    d_logits[np.arange(len(y)), y] -= 1
+    d_logits /= len(y)
+    g = {"densa_w": planos.T @ d_logits, "densa_b": d_logits.sum(axis=0)}
+    d_p2 = (d_logits @ pesos["densa_w"].T).reshape(p2.shape)
+    d_z2 = (mascara2 * d_p2[:, :, None, :, None, :]).reshape(a2.shape) * (z2 > 0)
+    d_p1, g["conv2_w"], g["conv2_b"] = conv_3x3_gradiente(d_z2, janelas2, pesos["conv2_w"], p1.shape)
+    d_z1 = (mascara1 * d_p1[:, :, None, :, None, :]).reshape(a1.shape) * (z1 > 0)
+    _, g["conv1_w"], g["conv1_b"] = conv_3x3_gradiente(d_z1, janelas1, pesos["conv1_w"], x.shape)
+    return perda, g
+
+def softmax(logits):
+    e = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+def entrada_cnn(vetores):
+    largura, altura = TAMANHO_DIGITO
+    return (np.asarray(vetores, np.float32) - 0.5).reshape(-1, altura, largura, 1)
+
+def treinar_cnn(amostras, epocas=30, taxa=0.01, lote=64, semente=0):
+    # amostras: [(caminho da imagem original, código)]; Adam com semente fixa (treino reproduzível)
+    vetores, rotulos = [], []
+    for caminho, label in amostras:
+        digitos = segmentar_digitos(aplicar_preprocessamento_opencv(PILImage.open(caminho)))
+        if digitos is None or len(label) != len(digitos):
+            continue
+        for vetor, d in zip(digitos, label):
+            for variacao in variacoes_digito(vetor):
+                vetores.append(variacao)
+                rotulos.append(int(d))
+    if not vetores:
+        return None
+    x, y = entrada_cnn(vetores), np.array(rotulos)
+    rng = np.random.default_rng(semente)
+    largura, altura = TAMANHO_DIGITO
+    planos = 16 * (altura // 4) * (largura // 4)
+    pesos = {
+        "conv1_w": rng.normal(0, np.sqrt(2 / 9), (1, 3, 3, 8)).astype(np.float32),
+        "conv1_b": np.zeros(8, np.float32),
+        "conv2_w": rng.normal(0, np.sqrt(2 / 72), (8, 3, 3, 16)).astype(np.float32),
+        "conv2_b": np.zeros(16, np.float32),
+        "densa_w": rng.normal(0, np.sqrt(1 / planos), (planos, 10)).astype(np.float32),
+        "densa_b": np.zeros(10, np.float32),
+    }
+    momento = {k: np.zeros_like(v) for k, v in pesos.items()}
+    variancia = {k: np.zeros_like(v) for k, v in pesos.items()}
+    passo = 0
+    for _ in range(epocas):
+        ordem = rng.permutation(len(x))
+        for inicio in range(0, len(x), lote):
+            indices = ordem[inicio:inicio + lote]
+            _, gradientes = cnn_gradientes(pesos, x[indices], y[indices])
+            passo += 1
+            for k in pesos:
+                momento[k] = 0.9 * momento[k] + 0.1 * gradientes[k]
+                variancia[k] = 0.999 * variancia[k] + 0.001 * gradientes[k] ** 2
+                ajuste = (momento[k] / (1 - 0.9 ** passo)) / (np.sqrt(variancia[k] / (1 - 0.999 ** passo)) + 1e-8)
+                pesos[k] = (pesos[k] - taxa * ajuste).astype(np.float32)
+    return pesos
+
+def classificar_lote_cnn(imagens_proc, pesos):
+    # Retorna [(dígitos, margem)] por imagem; margem = menor diferença, entre os 4 dígitos,
+    # da probabilidade do mais provável para a do segundo
+    segmentados = [segmentar_digitos(image_proc) for image_proc in imagens_proc]
+    validos = [s for s in segmentados if s is not None]
+    if not validos:
+        return [("", 0.0)] * len(imagens_proc)
+    probs = softmax(cnn_propagar(pesos, entrada_cnn(np.concatenate(validos))))
+    resultados, posicao = [], 0
+    for s in segmentados:
+        if s is None:
+            resultados.append(("", 0.0))
+            continue
+        p = probs[posicao:posicao + len(s)]
+        posicao += len(s)
+        ordenadas = np.sort(p, axis=1)
+        resultados.append(("".join(str(d) for d in p.argmax(axis=1)), float((ordenadas[:, -1] - ordenadas[:, -2]).min())))
+    return resultados
+
+# --- Coleta de CAPTCHAs rotulados ---
+# Todo código aceito pelo site rotula a imagem de graça: ela entra em cvm_coletado/ no
+# formato de cvm_treino (captchas/NN.png + linha NN do labels.txt + NN.box). Códigos
+# recusados e leituras sem resposta vão para cvm_coletado/revisao/, com o palpite do
+# OCR (ou "????") no labels.txt para correção manual. Imagens repetidas (mesmo hash
+# dos pixels) não entram de novo.
+lock_coleta = threading.Lock()
+proximo_indice_coleta = {}
+hashes_coleta = {}
+
+def hash_imagem(image):
+    rgb = image.convert("RGB")
+    return hashlib.sha256(f"{rgb.size}".encode() + rgb.tobytes()).hexdigest()
+
+def hashes_amostras(amostras):
+    return {hash_imagem(PILImage.open(caminho)) for caminho, _ in amostras}
+
+def linhas_box(image_proc, codigo, altura):
+    # .box do Tesseract: "<char> <esq> <baixo> <dir> <cima> 0", origem no canto inferior
+    # esquerdo, em pixels da imagem original (a processada tem o dobro do tamanho)
+    caixas = caixas_digitos((np.asarray(image_proc) > 127).astype(np.uint8), len(codigo))
+    if caixas is None:
+        return []
+    return [f"{d} {x0 // 2} {altura - (y1 + 1) // 2} {(x1 + 1) // 2} {altura - y0 // 2} 0"
+            for d, (x0, x1, y0, y1) in zip(codigo, caixas)]
+
+def adicionar_amostra(raiz, image, label, box=None):
+    pasta = os.path.join(raiz, "captchas")
+    arquivo_labels = os.path.join(raiz, "labels.txt")
+    codigo_hash = hash_imagem(image)
+    with lock_coleta:
+        if raiz not in proximo_indice_coleta:
+            os.makedirs(pasta, exist_ok=True)
+            existentes = 0
+            if os.path.exists(arquivo_labels):
+                with open(arquivo_labels, encoding="utf-8") as f:
+                    existentes = sum(1 for linha in f if linha.strip())
+            proximo_indice_coleta[raiz] = existentes + 1
+            hashes_coleta[raiz] = hashes_amostras(amostras_treino(pasta, arquivo_labels))
+        if codigo_hash in hashes_coleta[raiz]:
+            return
+        hashes_coleta[raiz].add(codigo_hash)
+        indice = proximo_indice_coleta[raiz]
+        proximo_indice_coleta[raiz] += 1
+        image.save(os.path.join(pasta, f"{indice:02d}.png"))
+        if box:
+            with open(os.path.join(pasta, f"{indice:02d}.box"), "w", encoding="utf-8") as f:
+                f.write("\n".join(box) + "\n")
+        with open(arquivo_labels, "a", encoding="utf-8") as f:
+            f.write(label + "\n")
+
+def coletar_captcha(image, codigo, estado):
+    # estado: resultado do envio ("formulario", "pagina", "captcha_recusado", "tempo_esgotado") ou "sem_leitura"
+    if not COLETAR_CAPTCHAS:
+        return
+    try:
+        if estado in ("formulario", "pagina") and codigo:
+            box = linhas_box(aplicar_preprocessamento_opencv(image), codigo, image.height)
+            validacao = int(hash_imagem(image), 16) % PROPORCAO_VALIDACAO == 0
+            adicionar_amostra(PASTA_VALIDACAO if validacao else PASTA_COLETA, image, codigo, box)
+        elif estado in ("captcha_recusado", "sem_leitura"):
+            adicionar_amostra(PASTA_REVISAO, image, codigo or "????")
+    except OSError as e:
+        print(f"Falha ao guardar o CAPTCHA coletado: {e}", flush=True)
+
+# --- Tesseract ---
+# O pytesseract cria um processo, grava arquivos temporários e recarrega o
+# traineddata a cada chamada (até 8 por CAPTCHA). Com o tesserocr a API fica
+# carregada no processo, com um handle por thread (a API não é thread-safe).
+tesseract_local = threading.local()
+# Modelos que o tesserocr não conseguiu carregar (ex.: tessdata ausente): tentados uma
+# vez por processo, depois passam para o pytesseract
+modelos_sem_tesserocr = set()
+
+def api_tesseract(modelo="eng"):
+    # Retorna o handle da thread, ou None se o tesserocr não estiver disponível
+    if not USAR_TESSEROCR or tesserocr is None or modelo in modelos_sem_tesserocr:
+        return None
+    apis = getattr(tesseract_local, "apis", None)
+    if apis is None:
+        apis = tesseract_local.apis = {}
+    if modelo not in apis:
+        try:
+            # eng vem do tessdata do sistema; modelos próprios, de PASTA_MODELOS
+            if modelo == "eng":
+                api = tesserocr.PyTessBaseAPI(lang=modelo)
+            else:
+                api = tesserocr.PyTessBaseAPI(path=PASTA_MODELOS, lang=modelo)
+        except RuntimeError as e:
+            if modelo not in modelos_sem_tesserocr:
+                modelos_sem_tesserocr.add(modelo)
+                print(f"tesserocr não carregou o modelo {modelo} ({e}); usando o pytesseract", flush=True)
+            return None
+        api.SetVariable("tessedit_char_whitelist", WHITELIST_OCR)
+        apis[modelo] = api
+    return apis[modelo]
+
+def tesseract_disponivel(modelo="eng"):
+    return api_tesseract(modelo) is not None or shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+
+def tesseract_texto(image, psm, modelo="eng"):
+    # Retorna (texto, [(dígito, confiança 0-1)]). Mesma configuração nos dois caminhos:
+    # modelo, OEM padrão, PSM e whitelist
+    api = api_tesseract(modelo)
+    if api is not None:
+        api.SetPageSegMode(psm)
+        api.SetImage(image)
+        api.Recognize()
+        simbolos = []
+        iterador = api.GetIterator()
+        if iterador is not None:
+            nivel = tesserocr.RIL.SYMBOL
+            for simbolo in tesserocr.iterate_level(iterador, nivel):
+                try:
+                    caractere = simbolo.GetUTF8Text(nivel)
+                except RuntimeError:
+                    # Símbolo sem texto (bloco vazio): o tesserocr levanta em vez de devolver ""
+                    continue
+                if caractere and caractere.isdigit():
+                    simbolos.append((caractere, simbolo.Confidence(nivel) / 100))
+        return api.GetUTF8Text(), simbolos
+    config = f"--psm {psm} -c tessedit_char_whitelist={WHITELIST_OCR}"
+    if modelo != "eng":
+        config = f"--tessdata-dir {PASTA_MODELOS} {config}"
+    dados = pytesseract.image_to_data(image, lang=modelo, config=config, output_type=pytesseract.Output.DICT)
+    palavras = [(str(t), float(c)) for t, c in zip(dados["text"], dados["conf"]) if float(c) >= 0 and str(t).strip()]
+    # O TSV do Tesseract só traz a confiança da palavra: cada dígito herda a da sua palavra
+    simbolos = [(caractere, c / 100) for t, c in palavras for caractere in t if caractere.isdigit()]
+    return " ".join(t for t, _ in palavras), simbolos
+
+def votar_leituras(leituras):
+    # leituras: {psm ou variante: [(dígito, confiança)]}. Só leituras com exatamente 4
+    # dígitos votam. Em cada posição vence o dígito com a maior soma de confianças; a
+    # confiança da posição é essa soma dividida pelo total de leituras (certeza x
+    # concordância) e a do código é a da pior posição.
+    validas = [simbolos for simbolos in leituras.values() if len(simbolos) == 4]
+    if not validas:
+        return "", 0.0
+    digitos, confiancas = "", []
+    for posicao in range(4):
+        votos = {}
+        for simbolos in validas:
+            digito, confianca = simbolos[posicao]
+            votos[digito] = votos.get(digito, 0.0) + confianca
+        vencedor = max(votos, key=votos.get)
+        digitos += vencedor
+        confiancas.append(votos[vencedor] / len(leituras))
+    return digitos, min(confiancas)
+
+# Os PSMs de um CAPTCHA rodam em paralelo: o tesserocr libera o GIL durante o
+# reconhecimento (cada thread do pool tem sua API) e o pytesseract usa processos
+executor_tesseract = None
+lock_executor_tesseract = threading.Lock()
+
+def ordem_psms():
+    # PSMs do mais para o menos confiável (taxa de acerto suavizada; empate mantém a
+    # ordem de PSMS_OCR). Com histórico suficiente, os que quase nunca acertam saem.
+    with lock_registro:
+        historico = {psm: estatisticas_psm.get(psm, (0, 0)) for psm in PSMS_OCR}
+    taxas = {psm: (acertos + 1) / (tentativas + 2) for psm, (tentativas, acertos) in historico.items()}
+    ordem = sorted(PSMS_OCR, key=lambda psm: -taxas[psm])
+    mantidos = [psm for psm in ordem if historico[psm][0] < MINIMO_TENTATIVAS_PSM or taxas[psm] >= TAXA_MINIMA_PSM]
+    return mantidos or ordem[:1], taxas
+
+def variantes_ativas():
+    # Mesma regra dos PSMs: "opencv" primeiro, depois as de melhor taxa; com histórico
+    # suficiente, as que quase nunca acertam saem
+    with lock_registro:
+        historico = {v: estatisticas_variantes.get(v, (0, 0)) for v in VARIANTES_PREPROCESSAMENTO}
+    taxas = {v: (acertos + 1) / (avaliacoes + 2) for v, (avaliacoes, acertos) in historico.items()}
+    mantidas = [v for v in VARIANTES_PREPROCESSAMENTO
+                if v == "opencv" or historico[v][0] < MINIMO_AVALIACOES_VARIANTE or taxas[v] >= TAXA_MINIMA_VARIANTE]
+    return sorted(mantidas, key=lambda v: (v != "opencv", -taxas[v]))[:MAXIMO_VARIANTES]
+
+def executor_psms():
+    global executor_tesseract
+    with lock_executor_tesseract:
+        if executor_tesseract is None:
+            executor_tesseract = ThreadPoolExecutor(thread_name_prefix="tesseract")
+        return executor_tesseract
+
+# --- Backends de OCR ---
+# Cada backend tem seu pré-processamento e seu reconhecimento e devolve candidatos
+# (rótulo, texto lido, dígitos, confiança). ler_captcha() percorre ORDEM_OCR e aceita
+# o primeiro candidato de 4 dígitos com confiança >= confianca_minima do backend.
+class BackendOCR:
+    nome = ""
+    preprocessamento = "opencv"  # backends com o mesmo nome reaproveitam a imagem processada
+    confianca_minima = 0.0
+    treinavel = False
+    avaliando = False  # ligado pelo benchmark
+
+    def disponivel(self):
+        return True
+
+    def preprocessar(self, image):
+        return aplicar_preprocessamento_opencv(image)
+
+    def reconhecer(self, image_proc):
+        raise NotImplementedError
+
+    def reconhecer_lote(self, imagens_proc):
+        # Backends com inferência em lote sobrescrevem
+        return [self.reconhecer(image_proc) for image_proc in imagens_proc]
+
+    def registrar_avaliacao(self, amostra, label):
+        # Chamado pelo benchmark depois de reconhecer uma amostra rotulada (amostra: caminho da imagem)
+        pass
+
+class BackendClassificador(BackendOCR):
+    nome = "knn"
+    confianca_minima = MARGEM_CLASSIFICADOR
+    treinavel = True
+
+    def __init__(self):
+        self.modelo = None
+        self.lock = threading.Lock()
+
+    def carregar(self):
+        # Montado na primeira leitura; os workers compartilham o mesmo modelo
+        with self.lock:
+            if self.modelo is None:
+                self.modelo = treinar_classificador(amostras_classificador())
+            return self.modelo
+
+    def treinar(self, amostras):
+        with self.lock:
+            self.modelo = treinar_classificador(amostras)
+
+    def disponivel(self):
+        return len(self.carregar()[1]) > 0
+
+    def reconhecer(self, image_proc):
+        digits, margem = classificar_digitos(image_proc, self.carregar())
+        return [("knn", f"{digits} (margem {margem:.2f})", digits, margem)]
+
+class BackendCNN(BackendOCR):
+    nome = "cnn"
+    confianca_minima = CONFIANCA_MINIMA_CNN
+    treinavel = True
+
+    def __init__(self):
+        self.modelo = None
+        self.modelo_knn = None  # treinado junto no benchmark; fora dele, o do backend knn
+        self.lock = threading.Lock()
+
+    def carregar(self):
+        with self.lock:
+            if self.modelo is None and os.path.exists(ARQUIVO_CNN):
+                with np.load(ARQUIVO_CNN) as arquivo:
+                    self.modelo = {k: arquivo[k] for k in arquivo.files}
+            return self.modelo
+
+    def treinar(self, amostras):
+        modelo = treinar_cnn(amostras)
+        modelo_knn = treinar_classificador(amostras)
+        with self.lock:
+            self.modelo = modelo
+            self.modelo_knn = modelo_knn
+
+    def disponivel(self):
+        return self.carregar() is not None
+
+    def reconhecer(self, image_proc):
+        return self.reconhecer_lote([image_proc])[0]
+
+    def reconhecer_lote(self, imagens_proc):
+        pesos = self.carregar()
+        if pesos is None:
+            return [[] for _ in imagens_proc]  # modelo ainda não treinado: passa para o próximo backend
+        knn = BACKENDS_OCR["knn"]
+        modelo_knn = self.modelo_knn or (knn.carregar() if knn.disponivel() else None)
+        candidatos = []
+        for image_proc, (digits, margem) in zip(imagens_proc, classificar_lote_cnn(imagens_proc, pesos)):
+            # Sem concordância com o knn a leitura não é enviada (confiança 0)
+            leitura_knn = classificar_digitos(image_proc, modelo_knn)[0] if digits and modelo_knn is not None else ""
+            confianca = margem if digits and leitura_knn == digits else 0.0
+            candidatos.append([("cnn", f"{digits} (margem {margem:.2f}, knn {leitura_knn or '-'})", digits, confianca)])
+        return candidatos
+
+class BackendTesseract(BackendOCR):
+    nome = "tesseract"
+    confianca_minima = CONFIANCA_MINIMA_TESSERACT
+
+    def disponivel(self):
+        return tesseract_disponivel()
+
+    def reconhecer(self, image_proc):
+        ordem, taxas = ordem_psms()
+        # Primeiro só o PSM com o melhor histórico; se não bastar, os demais rodam em paralelo e votam
+        primeiro = ordem[0]
+        resultados = {primeiro: tesseract_texto(image_proc, primeiro)}
+        simbolos = resultados[primeiro][1]
+        confianca = taxas[primeiro] * min(c for _, c in simbolos) if len(simbolos) == 4 else 0.0
+        if confianca >= CONFIANCA_MINIMA_PSM_UNICO:
+            digits = "".join(d for d, _ in simbolos)
+        else:
+            restantes = ordem[1:]
+            resultados.update(zip(restantes, executor_psms().map(lambda psm: tesseract_texto(image_proc, psm), restantes)))
+            digits, confianca = votar_leituras({psm: simbolos for psm, (_, simbolos) in resultados.items()})
+        # Guardado para registrar_resultado_psms() quando o site responder
+        tesseract_local.leituras = {psm: "".join(d for d, _ in simbolos) for psm, (_, simbolos) in resultados.items()}
+        leituras = " ".join(f"psm {psm}={text.strip() or '-'}" for psm, (text, _) in resultados.items())
+        return [("tesseract", f"{leituras} -> {digits or '-'} ({confianca:.2f})", digits, confianca)]
+
+class BackendTesseractCVM(BackendTesseract):
+    # Modelo treinado com os CAPTCHAs da CVM: uma chamada com um único PSM, sem votação
+    nome = "tesseract-cvm"
+
+    def disponivel(self):
+        arquivo = os.path.join(PASTA_MODELOS, f"{MODELO_TESSERACT_CVM}.traineddata")
+        return os.path.exists(arquivo) and tesseract_disponivel(MODELO_TESSERACT_CVM)
+
+    def reconhecer(self, image_proc):
+        text, simbolos = tesseract_texto(image_proc, PSM_MODELO_CVM, MODELO_TESSERACT_CVM)
+        digits = "".join(d for d, _ in simbolos) if len(simbolos) == 4 else ""
+        confianca = min(c for _, c in simbolos) if digits else 0.0
+        return [("tesseract-cvm", f"psm {PSM_MODELO_CVM}={text.strip() or '-'} ({confianca:.2f})", digits, confianca)]
+
+class BackendVariantes(BackendTesseract):
+    # Cada variante de pré-processamento é lida com o melhor PSM, em paralelo, e as
+    # leituras votam posição a posição. No benchmark rodam todas, para medir cada uma,
+    # mas só as ativas votam: a resposta é a mesma da extração.
+    nome = "tesseract-variantes"
+    preprocessamento = "original"
+    confianca_minima = CONFIANCA_MINIMA_VARIANTES
+
+    def preprocessar(self, image):
+        return image  # as variantes são aplicadas em reconhecer(), dentro do pool
+
+    def reconhecer(self, image):
+        ativas = variantes_ativas()
+        variantes = list(VARIANTES_PREPROCESSAMENTO) if self.avaliando else ativas
+        psm = ordem_psms()[0][0]
+        resultados = dict(zip(variantes, executor_psms().map(
+            lambda v: tesseract_texto(VARIANTES_PREPROCESSAMENTO[v](image), psm), variantes)))
+        digits, confianca = votar_leituras({v: simbolos for v, (_, simbolos) in resultados.items() if v in ativas})
+        # Guardado para registrar_avaliacao()
+        tesseract_local.leituras_variantes = {v: "".join(d for d, _ in simbolos) for v, (_, simbolos) in resultados.items()}
+        leituras = " ".join(f"{v}={text.strip() or '-'}" for v, (text, _) in resultados.items())
+        return [("tesseract-variantes", f"psm {psm}: {leituras} -> {digits or '-'} ({confianca:.2f})", digits, confianca)]
+
+    def registrar_avaliacao(self, amostra, label):
+        registrar_avaliacao_variantes(getattr(tesseract_local, "leituras_variantes", {}), amostra, label)
+
+BACKENDS_OCR = {}
+
+def registrar_backend_ocr(backend):
+    BACKENDS_OCR[backend.nome] = backend
+    return backend
+
+registrar_backend_ocr(BackendClassificador())
+registrar_backend_ocr(BackendCNN())
+registrar_backend_ocr(BackendTesseract())
+registrar_backend_ocr(BackendTesseractCVM())
+registrar_backend_ocr(BackendVariantes())
+
+# nome -> disponivel(), verificado uma vez por processo (carrega modelos, procura o tesseract)
+backends_disponiveis = {}
+
+def backend_disponivel(nome_backend):
+    if nome_backend not in backends_disponiveis:
+        backends_disponiveis[nome_backend] = BACKENDS_OCR[nome_backend].disponivel()
+        if not backends_disponiveis[nome_backend]:
+            print(f"Backend de OCR {nome_backend} indisponível; ignorado.", flush=True)
+    return backends_disponiveis[nome_backend]
+
+def ler_captcha(image, image_proc=None):
+    # image_proc: saída de aplicar_preprocessamento_opencv, se já calculada (salvar_captcha)
+    ocr_tentativas = []
+    tesseract_local.leituras = {}
+    processadas = {"opencv": image_proc} if image_proc is not None else {}
+    for nome_backend in ORDEM_OCR:
+        if not backend_disponivel(nome_backend):
+            continue
+        backend = BACKENDS_OCR[nome_backend]
+        if backend.preprocessamento not in processadas:
+            processadas[backend.preprocessamento] = backend.preprocessar(image)
+        for rotulo, text, digits, confianca in backend.reconhecer(processadas[backend.preprocessamento]):
+            ocr_tentativas.append((rotulo, text, digits))
+            if len(digits) == 4 and confianca >= backend.confianca_minima:
+                return digits, ocr_tentativas
+    return "", ocr_tentativas
+
+# Preenche e envia o formulário numa única chamada, pelo botão de envio (que vai junto
+# nos dados, como no Enter). O documento fica marcado para estado_resultado() saber
+# quando a página foi trocada.
+JS_ENVIAR_CAPTCHA = """
+const campo = document.getElementsByName("strCAPTCHA")[0];
+if (!campo || !campo.form) return false;
+campo.value = arguments[0];
+document.envioCaptcha = true;
+const botao = campo.form.querySelector("[type=submit], button:not([type])");
+if (botao) botao.click();
+else campo.form.requestSubmit();
+return true;
+"""
+
+def enviar_captcha(driver, captcha_text):
+    if driver.execute_script(JS_ENVIAR_CAPTCHA, captcha_text):
+        return
+    # Campo fora de um <form>: digita como antes
+    input_box = driver.find_element(By.NAME, "strCAPTCHA")
+    driver.execute_script("document.envioCaptcha = true;")
+    input_box.clear()
+    input_box.send_keys(captcha_text + "\n")
+
+def aguardar_resultado(driver, timeout=TIMEOUT_RESULTADO_S):
+    # "tempo_esgotado": a página de resultado não apareceu (envio sem navegação, site lento)
+    estado = aguardar_estado(lambda: estado_resultado(driver), timeout, ESPERA_RESULTADO_MS, fallback=lambda: "pagina")
+    return estado or "tempo_esgotado"
+
+def baixar_formulario(driver, chave, nome, estado=None):
+    if estado == "captcha_recusado":
+        return "Erro: CAPTCHA recusado", ""
+    if estado == "tempo_esgotado":
+        # Não é "Sem Formulário": a empresa continua pendente para a próxima execução
+        return "Erro: tempo esgotado aguardando o resultado", ""
+    try:
+        links = sondar_pagina(driver)["formularios"]
+        if links:
+            return salvar_pdf(links[0], chave, nome)
+        return "Sem Formulário", ""
+    except Exception as e:
+        return f"Erro: {str(e)}", ""
+
+class DownloadInvalido(Exception):
+    pass
+
+# --- Download retomável: <arquivo>.pdf.part + <arquivo>.pdf.part.json (url, etag, bytes recebidos) ---
+def ler_estado_download(temp_path):
+    sidecar = temp_path + ".json"
+    if not (os.path.exists(temp_path) and os.path.exists(sidecar)):
+        return None
+    try:
+        with open(sidecar, encoding="utf-8") as f:
+            estado = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Após uma queda o .part pode ter mais bytes que o registrado; vale o menor
+    estado["recebidos"] = min(int(estado.get("recebidos", 0)), os.path.getsize(temp_path))
+    return estado
+
+def gravar_estado_download(temp_path, estado):
+    sidecar = temp_path + ".json"
+    with open(sidecar + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(estado, f)
+    os.replace(sidecar + ".tmp", sidecar)
+
+def descartar_download(temp_path):
+    for caminho in (temp_path, temp_path + ".json"):
+        if os.path.exists(caminho):
+            os.remove(caminho)
+
+def intervalo_content_range(valor):
+    # "bytes 100-199/1000" -> (100, 1000); "bytes */1000" -> (None, 1000)
+    try:
+        faixa, total = valor.split()[1].split("/")
+        inicio = None if faixa == "*" else int(faixa.split("-")[0])
+        return inicio, (int(total) if total != "*" else None)
+    except (AttributeError, IndexError, ValueError):
+        return None, None
+
+def baixar_pdf_parcial(cliente, full_url, temp_path):
+    estado = ler_estado_download(temp_path)
+    headers = {}
+    if estado and estado["recebidos"] > 0 and (estado.get("url") == full_url or estado.get("etag") or estado.get("last_modified")):
+        headers["Range"] = f"bytes={estado['recebidos']}-"
+        validador = estado.get("etag") or estado.get("last_modified")
+        if validador:
+            # Se o arquivo mudou no servidor ele responde 200 com o arquivo inteiro
+            headers["If-Range"] = validador
+    else:
+        estado = None
+
+    with cliente.get(full_url, headers=headers, stream=True, timeout=TIMEOUT_DOWNLOAD_S) as r:
+        if r.status_code == 416 and estado:
+            _, total = intervalo_content_range(r.headers.get("Content-Range"))
+            if total is not None and total == estado["recebidos"]:
+                return validar_pdf_baixado(temp_path, total)
+            descartar_download(temp_path)
+            raise requests.ConnectionError("intervalo recusado pelo servidor; reiniciando download")
+        r.raise_for_status()
+
+        comprimido = bool(r.headers.get("Content-Encoding"))
+        if r.status_code == 206 and estado:
+            inicio_range, total = intervalo_content_range(r.headers.get("Content-Range"))
+            if inicio_range != estado["recebidos"]:
+                descartar_download(temp_path)
+                raise requests.ConnectionError("intervalo inesperado; reiniciando download")
+            recebidos = estado["recebidos"]
+        else:
+            # Servidor ignorou o Range (ou não havia .part): começa do zero
+            recebidos = 0
+            total = None if comprimido else int(r.headers.get("Content-Length") or 0) or None
+        estado = {
+            "url": full_url,
+            "etag": r.headers.get("ETag") or (estado or {}).get("etag"),
+            "last_modified": r.headers.get("Last-Modified") or (estado or {}).get("last_modified"),
+            "total": total,
+            "recebidos": recebidos,
+        }
+
+        modo = "r+b" if recebidos else "wb"
+        with open(temp_path, modo) as f:
+            f.truncate(recebidos)
+            f.seek(recebidos)
+            if recebidos:
+                with open(temp_path, "rb") as existente:
+                    inicio = existente.read(5)
+                    existente.seek(max(0, recebidos - 1024))
+                    final = existente.read(1024)
+            else:
+                inicio = b""
+                final = b""
+            # Conteúdo comprimido não pode ser retomado por bytes
+            if not comprimido:
+                gravar_estado_download(temp_path, estado)
+            desde_estado = 0
+            try:
+                for bloco in r.iter_content(TAMANHO_BLOCO_DOWNLOAD):
+                    if len(inicio) < 5:
+                        inicio += bloco[:5 - len(inicio)]
+                        if len(inicio) >= 5 and not inicio.startswith(b"%PDF-"):
+                            raise DownloadInvalido("arquivo não é PDF")
+                    recebidos += len(bloco)
+                    if total and recebidos > total:
+                        raise DownloadInvalido(f"recebidos {recebidos} bytes, esperados {total}")
+                    final = (final + bloco)[-1024:]
+                    f.write(bloco)
+                    desde_estado += len(bloco)
+                    if desde_estado >= INTERVALO_ESTADO_DOWNLOAD and not comprimido:
+                        f.flush()
+                        os.fsync(f.fileno())
+                        gravar_estado_download(temp_path, dict(estado, recebidos=recebidos))
+                        desde_estado = 0
+            finally:
+                f.flush()
+                os.fsync(f.fileno())
+                if not comprimido:
+                    gravar_estado_download(temp_path, dict(estado, recebidos=recebidos))
+
+    if recebidos <= TAMANHO_MINIMO_PDF:
+        raise DownloadInvalido("arquivo vazio")
+    if total and recebidos != total:
+        raise requests.ConnectionError(f"download incompleto ({recebidos} de {total} bytes)")
+    if b"%%EOF" not in final:
+        raise DownloadInvalido("PDF truncado (sem %%EOF)")
+
+def validar_pdf_baixado(temp_path, total):
+    with open(temp_path, "rb") as f:
+        inicio = f.read(5)
+        f.seek(max(0, total - 1024))
+        final = f.read(1024)
+    if not inicio.startswith(b"%PDF-") or b"%%EOF" not in final:
+        raise DownloadInvalido("PDF inválido")
+
+def salvar_pdf(full_url, chave, nome, sessao=None):
+    # Baixa em blocos para um .part e só renomeia para .pdf depois de validado,
+    # então obter_empresas_com_formulario nunca vê um PDF pela metade. Em quedas
+    # de conexão o .part é mantido e o restante é pedido com Range, nesta ou na
+    # próxima execução.
+    filename = f"{nome_arquivo_base(chave, nome)}_FORMULARIO.pdf"
+    path = os.path.join(PASTA_FORMULARIOS, filename)
+    temp_path = path + ".part"
+    cliente = sessao or requests
+    erro = None
+    for tentativa in range(1, TENTATIVAS_DOWNLOAD + 1):
+        try:
+            baixar_pdf_parcial(cliente, full_url, temp_path)
+            os.replace(temp_path, path)
+            descartar_download(temp_path)
+            return "Baixado", filename
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            erro = e
+        except Exception as e:
+            descartar_download(temp_path)
+            return f"Erro: {str(e)}", ""
+    return f"Erro: {str(erro)}", ""
+
+def processar_empresa(driver, nome, link, refazer_se_cair=False):
+    # Mesmo fluxo da GUI (abrir -> OCR -> enviar -> baixar), de forma síncrona.
+    # refazer_se_cair: se o Chrome morreu, levanta SessaoPerdida em vez de registrar o erro
+    chave = chave_empresa(link, nome)
+    try:
+        bloquear_recursos(driver, link)
+        driver.get(link)
+        marcar_inicializacao("navegacao")
+        captcha = localizar_captcha(driver)
+        for tentativa in range(RENOVACOES_CAPTCHA + 1):
+            if captcha is None:
+                registrar_log(chave, nome, "Erro OCR: CAPTCHA não encontrado", "")
+                return
+            image, image_proc, processado_path = capturar_captcha(driver, chave, nome)
+            captcha_text, ocr_tentativas = ler_captcha(image, image_proc)
+            if not captcha_text:
+                coletar_captcha(image, "", "sem_leitura")
+                captcha = renovar_captcha(driver) if tentativa < RENOVACOES_CAPTCHA else None
+                continue
+            enviar_captcha(driver, captcha_text)
+            estado = aguardar_resultado(driver)
+            registrar_resultado_psms(captcha_text, estado)
+            coletar_captcha(image, captcha_text, estado)
+            if estado != "captcha_recusado" or tentativa == RENOVACOES_CAPTCHA:
+                break
+            # A página de recusa já traz outro CAPTCHA
+            captcha = localizar_captcha(driver)
+        if not captcha_text:
+            detalhes = " | ".join([f"{p}: {t}" for p, t, _ in ocr_tentativas])
+            registrar_log(chave, nome, "Erro OCR: não leu 4 dígitos", processado_path, detalhes)
+            return
+
+        status, filename = baixar_formulario(driver, chave, nome, estado)
+        registrar_log(chave, nome, status, filename, captcha_text)
+    except Exception as e:
+        if refazer_se_cair and not navegador_vivo(driver):
+            raise SessaoPerdida(str(e).strip()) from e
+        registrar_log(chave, nome, f"Erro OCR: {str(e)}", "")
+
+# === MOTOR HTTP (sem navegador) ===
+class PaginaCVM(HTMLParser):
+    # Extrai da página do cadastro o CAPTCHA, os formulários HTML e os links
+    def __init__(self, url):
+        super().__init__(convert_charrefs=True)
+        self.url = url
+        self.captcha_src = None
+        self.formularios = []
+        self.links = []
+        self._form_atual = None
+        self._link_atual = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "form":
+            self._form_atual = {
+                "action": urllib.parse.urljoin(self.url, attrs.get("action") or self.url),
+                "method": (attrs.get("method") or "get").lower(),
+                "campos": {},
+            }
+            self.formularios.append(self._form_atual)
+        elif tag == "input" and self._form_atual is not None and attrs.get("name"):
+            if attrs.get("type", "").lower() in ("checkbox", "radio") and "checked" not in attrs:
+                return
+            self._form_atual["campos"].setdefault(attrs["name"], attrs.get("value") or "")
+        elif tag == "img" and CAMINHO_CAPTCHA in (attrs.get("src") or "") and not self.captcha_src:
+            self.captcha_src = urllib.parse.urljoin(self.url, attrs["src"])
+        elif tag == "a" and attrs.get("href"):
+            self._link_atual = [urllib.parse.urljoin(self.url, attrs["href"]), ""]
+
+    def handle_data(self, data):
+        if self._link_atual is not None:
+            self._link_atual[1] += data
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self._link_atual is not None:
+            self.links.append(tuple(self._link_atual))
+            self._link_atual = None
+        elif tag == "form":
+            self._form_atual = None
+
+    @property
+    def link_formulario(self):
+        for href, texto in self.links:
+            if "formulario de referencia" in normalizar_nome(" ".join(texto.split())):
+                return href
+        return None
+
+    @property
+    def form_captcha(self):
+        for form in self.formularios:
+            if "strCAPTCHA" in form["campos"]:
+                return form
+        return None
+
+    def estado(self):
+        # Mesmos estados de estado_resultado() no fluxo com navegador
+        if self.link_formulario:
+            return "formulario"
+        if self.captcha_src:
+            return "captcha_recusado"
+        return "pagina"
+
+def analisar_pagina(resposta):
+    pagina = PaginaCVM(resposta.url)
+    pagina.feed(resposta.text)
+    pagina.close()
+    return pagina
+
+def criar_sessao_http():
+    # Uma sessão por worker: mantém o cookie ASP (ao qual o CAPTCHA está vinculado)
+    # e reaproveita as conexões keep-alive entre as empresas
+    sessao = requests.Session()
+    retry = urllib3.util.Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504), allowed_methods=("GET", "HEAD"))
+    adaptador = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retry)
+    sessao.mount("https://", adaptador)
+    sessao.mount("http://", adaptador)
+    sessao.headers["User-Agent"] = USER_AGENT_HTTP
+    return sessao
+
+def redirecionar_link(link, servidor):
+    # Aponta o link da planilha para outro host (ex.: servidor_teste_cvm.py)
+    if not servidor:
+        return link
+    destino = urllib.parse.urlsplit(servidor)
+    return urllib.parse.urlsplit(link)._replace(scheme=destino.scheme, netloc=destino.netloc).geturl()
+
+def baixar_captcha_http(sessao, pagina):
+    r = sessao.get(pagina.captcha_src, headers={"Referer": pagina.url}, timeout=TIMEOUT_HTTP_S)
+    r.raise_for_status()
+    return PILImage.open(BytesIO(r.content))
+
+def enviar_captcha_http(sessao, pagina, captcha_text):
+    form = pagina.form_captcha
+    if form is None:
+        # Sem <form>: o próprio link aceita strCAPTCHA na query string
+        url = urllib.parse.urlsplit(pagina.url)
+        query = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        query["strCAPTCHA"] = captcha_text
+        r = sessao.get(url._replace(query=urllib.parse.urlencode(query)).geturl(), timeout=TIMEOUT_HTTP_S)
+    else:
+        campos = dict(form["campos"], strCAPTCHA=captcha_text)
+        if form["method"] == "post":
+            r = sessao.post(form["action"], data=campos, headers={"Referer": pagina.url}, timeout=TIMEOUT_HTTP_S)
+        else:
+            r = sessao.get(form["action"], params=campos, headers={"Referer": pagina.url}, timeout=TIMEOUT_HTTP_S)
+    r.raise_for_status()
+    return analisar_pagina(r)
+
+def processar_empresa_http(sessao, nome, link):
+    # Mesmo fluxo de processar_empresa(), só com requests: página -> CAPTCHA -> envio -> PDF
+    chave = chave_empresa(link, nome)
+    try:
+        r = sessao.get(link, timeout=TIMEOUT_HTTP_S)
+        r.raise_for_status()
+        marcar_inicializacao("navegacao")
+        pagina = analisar_pagina(r)
+        if not pagina.captcha_src:
+            registrar_log(chave, nome, "Erro OCR: CAPTCHA não encontrado", "")
+            return
+        for tentativa in range(RENOVACOES_CAPTCHA + 1):
+            # Cada GET do aspcaptcha.asp gera um novo código na sessão: renovar é só repetir o GET
+            image, image_proc, processado_path = salvar_captcha(baixar_captcha_http(sessao, pagina), chave, nome)
+            captcha_text, ocr_tentativas = ler_captcha(image, image_proc)
+            if not captcha_text:
+                coletar_captcha(image, "", "sem_leitura")
+                continue
+            resultado = enviar_captcha_http(sessao, pagina, captcha_text)
+            estado = resultado.estado()
+            registrar_resultado_psms(captcha_text, estado)
+            coletar_captcha(image, captcha_text, estado)
+            if estado != "captcha_recusado":
+                break
+            pagina = resultado  # a página de recusa traz o formulário com outro CAPTCHA
+        if not captcha_text:
+            detalhes = " | ".join([f"{p}: {t}" for p, t, _ in ocr_tentativas])
+            registrar_log(chave, nome, "Erro OCR: não leu 4 dígitos", processado_path, detalhes)
+            return
+
+        if estado == "formulario":
+            status, filename = salvar_pdf(resultado.link_formulario, chave, nome, sessao)
+        elif estado == "captcha_recusado":
+            status, filename = "Erro: CAPTCHA recusado", ""
+        else:
+            status, filename = "Sem Formulário", ""
+        registrar_log(chave, nome, status, filename, captcha_text)
+    except Exception as e:
+        registrar_log(chave, nome, f"Erro: {str(e)}", "")
+
+# === FLUXO GUI ===
+def aguardar_na_gui(verificar, ao_concluir, timeout_s, espera_fallback_ms=0, fallback=None):
+    # Mesmo que aguardar_estado, mas via root.after para não travar a interface
+    limite = time.monotonic() + timeout_s
+    def checar():
+        try:
+            resultado = verificar()
+        except (StaleElementReferenceException, NoSuchElementException, JavascriptException):
+            resultado = None
+        except WebDriverException:
+            root.after(espera_fallback_ms, lambda: ao_concluir(fallback() if fallback else None))
+            return
+        if resultado or time.monotonic() >= limite:
+            ao_concluir(resultado)
+        else:
+            root.after(INTERVALO_VERIFICACAO_MS, checar)
+    checar()
+
+aguardando_driver = False
+
+def esperar_driver():
+    global aguardando_driver
+    if driver_antecipado_pronto():
+        aguardando_driver = False
+        abrir_proximo()
+    else:
+        root.after(INTERVALO_VERIFICACAO_MS, esperar_driver)
+
 def abrir_proximo():
-    global atual, tempo_inicio
+    global atual, tempo_inicio, driver, aguardando_driver
+    if driver is not None and not navegador_vivo(driver):
+        # Chrome fechado ou travado: outro abre em segundo plano e a empresa atual é reaberta
+        encerrar_driver(driver)
+        driver = None
+        antecipar_driver()
+    if driver is None:
+        # O Chrome abre em segundo plano desde a inicialização: a janela já responde.
+        # Cliques enquanto ele abre não agendam uma segunda espera.
+        if aguardando_driver:
+            return
+        if not driver_antecipado_pronto():
+            aguardando_driver = True
+            label_status.config(text="Aguardando o Chrome abrir...")
+            root.after(INTERVALO_VERIFICACAO_MS, esperar_driver)
+            return
+        try:
+            driver = obter_driver()
+        except Exception as e:
+            messagebox.showerror("Chrome", f"Não foi possível abrir o Chrome: {e}")
+            return
     if atual == 0:
         tempo_inicio = datetime.now()
     
     if atual >= total:
-        with open(ARQUIVO_HTML_DIAGNOSTICO, "a", encoding="utf-8") as html:
-            html.write("</ul></body></html>")
+        finalizar_html_diagnostico()
         messagebox.showinfo("Concluído", f"Todos os registros foram processados.\nSucesso: {sucesso} | Falha: {falha}")
-        driver.quit()
+        encerrar_driver(driver)
         root.quit()
         return
 
     nome, link = companies[atual]
     label_status.config(text=f"{atual+1} de {total}: {nome}")
     label_resultado.config(text="Aguardando resolução do CAPTCHA...")
+    bloquear_recursos(driver, link)
     driver.get(link)
+    marcar_inicializacao("navegacao")
+    if medir_inicializacao:
+        encerrar_driver(driver)
+        root.quit()
+        return
     
     # Atualizar progresso e tempo estimado
     progresso = (atual + 1) / total * 100
@@ -156,39 +2062,20 @@ def abrir_proximo():
     root.update_idletasks()
 
     if ocr_ativo:
-        root.after(3000, executar_ocr_captcha)
+        aguardar_na_gui(lambda: captcha_carregado(driver), executar_ocr_captcha, TIMEOUT_CAPTCHA_S, ESPERA_CAPTCHA_MS,
+                        fallback=lambda: primeiro_captcha(driver))
 
-def aplicar_preprocessamento_opencv(image_pil):
-    image_np = np.array(image_pil.convert("L"))
-    _, bin_img = cv2.threshold(image_np, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    bin_img = cv2.bitwise_not(bin_img)
-    bin_img = cv2.medianBlur(bin_img, 3)
-    kernel = np.ones((1, 1), np.uint8)
-    bin_img = cv2.dilate(bin_img, kernel, iterations=1)
-    bin_img = cv2.erode(bin_img, kernel, iterations=1)
-    bin_img = cv2.resize(bin_img, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
-    return Image.fromarray(bin_img)
-
-def executar_ocr_captcha(tentativa=1):
+def executar_ocr_captcha(captcha, tentativa=1):
     global atual
-    nome, _ = companies[atual]
+    nome, link = companies[atual]
+    chave = chave_empresa(link, nome)
     try:
-        # Espera explícita pelo CAPTCHA
-        try:
-            img_elem = WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.XPATH, "//img[contains(@src, 'captcha/aspcaptcha.asp')]"))
-            )
-        except Exception as e:
-            registrar_log(nome, f"Erro OCR: CAPTCHA não encontrado", "")
+        if captcha is None:
+            registrar_log(chave, nome, f"Erro OCR: CAPTCHA não encontrado", "")
             label_resultado.config(text="CAPTCHA não encontrado na página.")
-            root.after(2000, proximo)
+            root.after_idle(proximo)
             return
-        png_data = img_elem.screenshot_as_png
-        image = PILImage.open(BytesIO(png_data))
-
-        nome_base = nome.strip().replace(' ', '_').replace('/', '_')
-        original_path = os.path.join(PASTA_CAPTCHAS, f"{nome_base}_original.png")
-        image.save(original_path)
+        image, image_proc, processado_path = capturar_captcha(driver, chave, nome)
 
         # Redimensionar imagem original para exibição
         img_original_resized = image.resize((150, 50))
@@ -196,75 +2083,54 @@ def executar_ocr_captcha(tentativa=1):
         captcha_original_label.config(image=img_original_tk)
         captcha_original_label.image = img_original_tk
 
-        # Processar imagem para OCR
-        image_proc = aplicar_preprocessamento_opencv(image)
-        processado_path = os.path.join(PASTA_CAPTCHAS, f"{nome_base}_processado.png")
-        image_proc.save(processado_path)
-
         # Redimensionar imagem processada para exibição
         img_proc_resized = image_proc.resize((150, 50))
         img_proc_tk = ImageTk.PhotoImage(img_proc_resized)
         captcha_processado_label.config(image=img_proc_tk)
         captcha_processado_label.image = img_proc_tk
 
-        ocr_tentativas = []
-        for psm in [6, 7, 8, 13]:
-            config = f"--psm {psm} -c tessedit_char_whitelist=0123456789"
-            text = pytesseract.image_to_string(image_proc, config=config)
-            digits = ''.join(filter(str.isdigit, text))[:4]
-            ocr_tentativas.append((psm, text.strip(), digits))
-            if len(digits) == 4:
-                captcha_text = digits
-                break
-        else:
-            captcha_text = ""
+        captcha_text, ocr_tentativas = ler_captcha(image, image_proc)
 
         if captcha_text and len(captcha_text) == 4:
-            input_box = driver.find_element(By.NAME, "strCAPTCHA")
-            input_box.clear()
-            input_box.send_keys(captcha_text + "\n")
-            root.after(5000, resolver_captcha)
-        elif tentativa < 2:
-            root.after(2000, lambda: executar_ocr_captcha(tentativa+1))
+            enviar_captcha(driver, captcha_text)
+            aguardar_na_gui(lambda: estado_resultado(driver),
+                            lambda estado: resolver_captcha(estado or "tempo_esgotado", captcha_text, tentativa, image), TIMEOUT_RESULTADO_S,
+                            ESPERA_RESULTADO_MS, fallback=lambda: "pagina")
+            return
+        coletar_captcha(image, "", "sem_leitura")
+        if tentativa <= RENOVACOES_CAPTCHA:
+            label_resultado.config(text="OCR sem resposta, pedindo outro CAPTCHA...")
+            pedir_novo_captcha(driver)
+            aguardar_na_gui(lambda: captcha_carregado(driver), lambda captcha: executar_ocr_captcha(captcha, tentativa+1),
+                            TIMEOUT_CAPTCHA_S, ESPERA_CAPTCHA_MS, fallback=lambda: primeiro_captcha(driver))
         else:
-            detalhes = " | ".join([f"psm {p}: {t}" for p, t, _ in ocr_tentativas])
-            registrar_log(nome, f"Erro OCR: não leu 4 dígitos", processado_path, captcha_text if captcha_text else detalhes)
+            detalhes = " | ".join([f"{p}: {t}" for p, t, _ in ocr_tentativas])
+            registrar_log(chave, nome, f"Erro OCR: não leu 4 dígitos", processado_path, captcha_text if captcha_text else detalhes)
             raise ValueError("OCR não conseguiu identificar 4 dígitos após múltiplos PSM")
 
     except Exception as e:
         erro_detalhe = traceback.format_exc(limit=1)
-        registrar_log(nome, f"Erro OCR: {str(e)}", "")
+        registrar_log(chave, nome, f"Erro OCR: {str(e)}", "")
         label_resultado.config(text=f"Erro OCR: {str(e)}")
-        root.after(2000, proximo)
+        root.after_idle(proximo)
 
 
-def resolver_captcha():
+def resolver_captcha(estado=None, captcha_text="", tentativa=1, image=None):
     global atual
-    nome, _ = companies[atual]
-    try:
-        label_resultado.config(text="Buscando link do formulário...")
-        links = driver.find_elements(By.PARTIAL_LINK_TEXT, "Formulário de Referência")
-        if links:
-            href = links[0].get_attribute("href")
-            full_url = urllib.parse.urljoin(driver.current_url, href)
-            filename = f"{nome.strip().replace(' ', '_').replace('/', '_')}_FORMULARIO.pdf"
-            path = os.path.join(PASTA_FORMULARIOS, filename)
-            r = requests.get(full_url)
-            with open(path, "wb") as f:
-                f.write(r.content)
-            if os.path.getsize(path) > 1000:
-                status = "Baixado"
-            else:
-                os.remove(path)
-                filename = ""
-                status = "Erro: arquivo vazio"
-        else:
-            status = "Sem Formulário"
-            filename = ""
-    except Exception as e:
-        status = f"Erro: {str(e)}"
-        filename = ""
-    registrar_log(nome, status, filename)
+    nome, link = companies[atual]
+    chave = chave_empresa(link, nome)
+    registrar_resultado_psms(captcha_text, estado)
+    if image is not None:
+        coletar_captcha(image, captcha_text, estado)
+    if estado == "captcha_recusado" and captcha_text and ocr_ativo and tentativa <= RENOVACOES_CAPTCHA:
+        # A página de recusa já mostra outro CAPTCHA: lê de novo sem recarregar
+        label_resultado.config(text="CAPTCHA recusado, tentando outro...")
+        aguardar_na_gui(lambda: captcha_carregado(driver), lambda captcha: executar_ocr_captcha(captcha, tentativa+1),
+                        TIMEOUT_CAPTCHA_S, ESPERA_CAPTCHA_MS, fallback=lambda: primeiro_captcha(driver))
+        return
+    label_resultado.config(text="Buscando link do formulário...")
+    status, filename = baixar_formulario(driver, chave, nome, estado)
+    registrar_log(chave, nome, status, filename, captcha_text)
     if ocr_ativo:
         proximo()
 
@@ -281,9 +2147,9 @@ def proximo():
 
 def pular():
     global falha
-    nome, _ = companies[atual]
+    nome, link = companies[atual]
     status = "Pulado pelo usuário"
-    registrar_log(nome, status, "")
+    registrar_log(chave_empresa(link, nome), nome, status, "")
     proximo()
 
 def iniciar_ocr_auto():
@@ -315,26 +2181,14 @@ def habilitar_botoes():
     btn_abort_ocr.config(state="disabled")
 
 def obter_empresas_com_formulario():
-    arquivos = os.listdir(PASTA_FORMULARIOS)
-    empresas_com_formulario = set()
-    for arq in arquivos:
-        if arq.lower().endswith(".pdf"):
-            nome_empresa = arq.replace("_FORMULARIO.pdf", "").replace("_", " ")
-            empresas_com_formulario.add(nome_empresa.lower())
-    return empresas_com_formulario
+    return chaves_por_situacao("baixado")
 
 def obter_empresas_sem_formulario():
     return empresas_sem_formulario
 
 def filtrar_empresas_faltantes():
-    baixados = obter_empresas_com_formulario()
-    sem_formulario = obter_empresas_sem_formulario()
-    faltantes = []
-    for nome, link in companies:
-        nome_limpo = nome.strip().lower()
-        if nome_limpo not in baixados and nome_limpo not in sem_formulario:
-            faltantes.append((nome, link))
-    return faltantes
+    concluidas = chaves_por_situacao("baixado", "sem_formulario")
+    return [(nome, link) for nome, link in companies if chave_empresa(link, nome) not in concluidas]
 
 def reprocessar_pendentes():
     global companies, total, atual, sucesso, falha
@@ -378,12 +2232,11 @@ class ToolTip:
             self.tooltip.destroy()
             self.tooltip = None
 
-# === GUI ===
-root = tk.Tk()
-root.title("Extrator de Formulários da CVM")
-root.geometry("800x600")
-root.configure(bg="#1e1e1e")
+# Empresas sem formulário de execuções anteriores (contador da GUI)
+def carregar_empresas_sem_formulario():
+    empresas_sem_formulario.update(chaves_por_situacao("sem_formulario"))
 
+# === GUI ===
 ascii_art = """
                                          ██████╗██╗   ██╗███╗   ███╗                                               
                                         ██╔════╝██║   ██║████╗ ████║                                               
@@ -401,99 +2254,615 @@ ascii_art = """
                                                                                                                    
 """
 
-
-label_ascii = tk.Label(root, text=ascii_art, font=("Courier", 16, "bold"), fg="#FFA500", bg="#1e1e1e")
-label_ascii.pack(pady=(5, 0))
-
-label_by = tk.Label(root, text="by P2FU2 - Version alpha 1.8", font=("Arial", 10, "italic"), fg="#FFA500", bg="#1e1e1e")
-label_by.pack()
-
-label_status = tk.Label(root, text="Clique em 'Iniciar' para comecar a leitura dos formularios", font=("Arial", 12), fg="#FFA500", bg="#1e1e1e")
-label_status.pack(pady=5)
-
-btn_abrir = tk.Button(root, text="Iniciar", font=("Arial", 11), command=abrir_proximo, bg="#2e2e2e", fg="#FFA500", width=25)
-btn_abrir.pack(pady=5)
-
-btn_resolver = tk.Button(root, text="CAPTCHA resolvido (baixar)", font=("Arial", 11), command=resolver_captcha, bg="#2e2e2e", fg="#FFA500", width=25)
-btn_resolver.pack(pady=5)
-
-btn_proximo = tk.Button(root, text="Próximo", font=("Arial", 11), command=proximo, bg="#2e2e2e", fg="#FFA500", width=25)
-btn_proximo.pack(pady=5)
-
-btn_pular = tk.Button(root, text="Pular Empresa", font=("Arial", 11), command=pular, bg="#882222", fg="white", width=25)
-btn_pular.pack(pady=5)
-
-btn_ocr = tk.Button(root, text="Iniciar Leitura OCR Automática", font=("Arial", 11), command=iniciar_ocr_auto, bg="#2e2e2e", fg="#FFA500", width=30)
-btn_ocr.pack(pady=5)
-
-btn_abort_ocr = tk.Button(root, text="Parar OCR e voltar para modo manual", font=("Arial", 11), command=abortar_ocr, bg="#882222", fg="white", width=30, state="disabled")
-btn_abort_ocr.pack(pady=5)
-
-btn_reprocessar = tk.Button(root, text="Reprocessar Pendentes", font=("Arial", 11), command=reprocessar_pendentes, bg="#2e2e2e", fg="#00ccff", width=30)
-btn_reprocessar.pack(pady=5)
-
-# Frame para as imagens do CAPTCHA
-captcha_frame = tk.Frame(root, bg="#1e1e1e")
-captcha_frame.pack(pady=5)
-
-# Label para a imagem original
-label_original = tk.Label(captcha_frame, text="Original:", font=("Arial", 10), fg="#FFA500", bg="#1e1e1e")
-label_original.pack(side=tk.LEFT, padx=10)
-
-captcha_original_label = tk.Label(captcha_frame, bg="#1e1e1e")
-captcha_original_label.pack(side=tk.LEFT, padx=10)
-
-# Label para a imagem processada
-label_processado = tk.Label(captcha_frame, text="Processado:", font=("Arial", 10), fg="#FFA500", bg="#1e1e1e")
-label_processado.pack(side=tk.LEFT, padx=10)
-
-captcha_processado_label = tk.Label(captcha_frame, bg="#1e1e1e")
-captcha_processado_label.pack(side=tk.LEFT, padx=10)
-
-label_resultado = tk.Label(root, text="Resultado: aguardando...", font=("Arial", 10), fg="#FFA500", bg="#1e1e1e")
-label_resultado.pack(pady=10)
-
-label_progresso = tk.Label(root, text="Progresso: 0% | Tempo estimado: --", font=("Arial", 10), fg="#FFA500", bg="#1e1e1e")
-label_progresso.pack(pady=5)
-
-# Nova label para mostrar sucesso, falha e sem formulário
-label_sucesso_falha = tk.Label(root, text="Sucesso: 0 | Falha: 0 | Sem Formulário: 0", font=("Arial", 11, "bold"), fg="#FFA500", bg="#1e1e1e")
-label_sucesso_falha.pack(pady=2)
-
-style = ttk.Style()
-style.theme_use('clam')
-style.configure("orange.Horizontal.TProgressbar", troughcolor='#333333', background='#FFA500', thickness=20)
-progress_var = tk.DoubleVar()
-progress_bar = ttk.Progressbar(root, variable=progress_var, maximum=100, length=600, style="orange.Horizontal.TProgressbar")
-progress_bar.pack(pady=5)
-
-if os.path.exists(LOGO_PATH):
-    img = Image.open(LOGO_PATH)
-    img = img.resize((100, 40), Image.LANCZOS)
-    logo_img = ImageTk.PhotoImage(img)
-    logo_label = tk.Label(root, image=logo_img, bg="#1e1e1e")
-    logo_label.place(relx=1.0, rely=1.0, x=-10, y=-10, anchor="se")
-
-# Adicionar tooltips aos botões
-ToolTip(btn_abrir, "Inicia o processo de extração do primeiro formulário da lista")
-ToolTip(btn_resolver, "Confirma que o CAPTCHA foi resolvido e baixa o formulário")
-ToolTip(btn_proximo, "Avança para o próximo formulário da lista")
-ToolTip(btn_pular, "Pula o formulário atual e avança para o próximo")
-ToolTip(btn_ocr, "Inicia o processo automático de leitura de CAPTCHA usando OCR")
-ToolTip(btn_abort_ocr, "Interrompe o processo automático de OCR e retorna ao modo manual")
-ToolTip(btn_reprocessar, "Reprocessa apenas os formulários que falharam anteriormente")
-
-# Função para ler empresas sem formulário do log
-def carregar_empresas_sem_formulario():
-    if not os.path.exists(ARQUIVO_LOG):
+def iniciar_gui():
+    global root, label_status, label_resultado, label_progresso, label_sucesso_falha, progress_var, captcha_original_label, captcha_processado_label, btn_abrir, btn_resolver, btn_proximo, btn_pular, btn_ocr, btn_abort_ocr, btn_reprocessar
+    root = tk.Tk()
+    root.title("Extrator de Formulários da CVM")
+    root.bind("<Map>", lambda evento: marcar_inicializacao("janela"), add="+")
+    if medir_inicializacao:
+        root.after_idle(abrir_proximo)
+    root.geometry("800x600")
+    root.configure(bg="#1e1e1e")
+
+    label_ascii = tk.Label(root, text=ascii_art, font=("Courier", 16, "bold"), fg="#FFA500", bg="#1e1e1e")
+    label_ascii.pack(pady=(5, 0))
+
+    label_by = tk.Label(root, text="by P2FU2 - Version alpha 1.8", font=("Arial", 10, "italic"), fg="#FFA500", bg="#1e1e1e")
+    label_by.pack()
+
+    label_status = tk.Label(root, text="Clique em 'Iniciar' para comecar a leitura dos formularios", font=("Arial", 12), fg="#FFA500", bg="#1e1e1e")
+    label_status.pack(pady=5)
+
+    btn_abrir = tk.Button(root, text="Iniciar", font=("Arial", 11), command=abrir_proximo, bg="#2e2e2e", fg="#FFA500", width=25)
+    btn_abrir.pack(pady=5)
+
+    btn_resolver = tk.Button(root, text="CAPTCHA resolvido (baixar)", font=("Arial", 11), command=resolver_captcha, bg="#2e2e2e", fg="#FFA500", width=25)
+    btn_resolver.pack(pady=5)
+
+    btn_proximo = tk.Button(root, text="Próximo", font=("Arial", 11), command=proximo, bg="#2e2e2e", fg="#FFA500", width=25)
+    btn_proximo.pack(pady=5)
+
+    btn_pular = tk.Button(root, text="Pular Empresa", font=("Arial", 11), command=pular, bg="#882222", fg="white", width=25)
+    btn_pular.pack(pady=5)
+
+    btn_ocr = tk.Button(root, text="Iniciar Leitura OCR Automática", font=("Arial", 11), command=iniciar_ocr_auto, bg="#2e2e2e", fg="#FFA500", width=30)
+    btn_ocr.pack(pady=5)
+
+    btn_abort_ocr = tk.Button(root, text="Parar OCR e voltar para modo manual", font=("Arial", 11), command=abortar_ocr, bg="#882222", fg="white", width=30, state="disabled")
+    btn_abort_ocr.pack(pady=5)
+
+    btn_reprocessar = tk.Button(root, text="Reprocessar Pendentes", font=("Arial", 11), command=reprocessar_pendentes, bg="#2e2e2e", fg="#00ccff", width=30)
+    btn_reprocessar.pack(pady=5)
+
+    # Frame para as imagens do CAPTCHA
+    captcha_frame = tk.Frame(root, bg="#1e1e1e")
+    captcha_frame.pack(pady=5)
+
+    # Label para a imagem original
+    label_original = tk.Label(captcha_frame, text="Original:", font=("Arial", 10), fg="#FFA500", bg="#1e1e1e")
+    label_original.pack(side=tk.LEFT, padx=10)
+
+    captcha_original_label = tk.Label(captcha_frame, bg="#1e1e1e")
+    captcha_original_label.pack(side=tk.LEFT, padx=10)
+
+    # Label para a imagem processada
+    label_processado = tk.Label(captcha_frame, text="Processado:", font=("Arial", 10), fg="#FFA500", bg="#1e1e1e")
+    label_processado.pack(side=tk.LEFT, padx=10)
+
+    captcha_processado_label = tk.Label(captcha_frame, bg="#1e1e1e")
+    captcha_processado_label.pack(side=tk.LEFT, padx=10)
+
+    label_resultado = tk.Label(root, text="Resultado: aguardando...", font=("Arial", 10), fg="#FFA500", bg="#1e1e1e")
+    label_resultado.pack(pady=10)
+
+    label_progresso = tk.Label(root, text="Progresso: 0% | Tempo estimado: --", font=("Arial", 10), fg="#FFA500", bg="#1e1e1e")
+    label_progresso.pack(pady=5)
+
+    # Nova label para mostrar sucesso, falha e sem formulário
+    label_sucesso_falha = tk.Label(root, text="Sucesso: 0 | Falha: 0 | Sem Formulário: 0", font=("Arial", 11, "bold"), fg="#FFA500", bg="#1e1e1e")
+    label_sucesso_falha.pack(pady=2)
+
+    style = ttk.Style()
+    style.theme_use('clam')
+    style.configure("orange.Horizontal.TProgressbar", troughcolor='#333333', background='#FFA500', thickness=20)
+    progress_var = tk.DoubleVar()
+    progress_bar = ttk.Progressbar(root, variable=progress_var, maximum=100, length=600, style="orange.Horizontal.TProgressbar")
+    progress_bar.pack(pady=5)
+
+    if os.path.exists(LOGO_PATH):
+        img = Image.open(LOGO_PATH)
+        img = img.resize((100, 40), Image.LANCZOS)
+        logo_img = ImageTk.PhotoImage(img)
+        logo_label = tk.Label(root, image=logo_img, bg="#1e1e1e")
+        logo_label.image = logo_img
+        logo_label.place(relx=1.0, rely=1.0, x=-10, y=-10, anchor="se")
+
+    # Adicionar tooltips aos botões
+    ToolTip(btn_abrir, "Inicia o processo de extração do primeiro formulário da lista")
+    ToolTip(btn_resolver, "Confirma que o CAPTCHA foi resolvido e baixa o formulário")
+    ToolTip(btn_proximo, "Avança para o próximo formulário da lista")
+    ToolTip(btn_pular, "Pula o formulário atual e avança para o próximo")
+    ToolTip(btn_ocr, "Inicia o processo automático de leitura de CAPTCHA usando OCR")
+    ToolTip(btn_abort_ocr, "Interrompe o processo automático de OCR e retorna ao modo manual")
+    ToolTip(btn_reprocessar, "Reprocessa apenas os formulários que falharam anteriormente")
+
+    root.mainloop()
+
+# === HEADLESS ===
+def worker_headless(fila, parar, motor="chrome", navegadores=None):
+    # Cada worker tem sua própria sessão (Chrome ou HTTP) e consome a fila compartilhada
+    if motor == "chrome":
+        return worker_chrome(fila, parar, navegadores)
+    try:
+        sessao = criar_sessao_http()
+    except Exception as e:
+        print(f"{threading.current_thread().name}: falha ao iniciar a sessão ({motor}): {e}", flush=True)
         return
-    with open(ARQUIVO_LOG, encoding="utf-8") as f:
-        for linha in f:
-            if "| Sem Formulário |" in linha:
-                partes = linha.split("|")
-                if len(partes) > 1:
-                    nome = normalizar_nome(partes[1])
-                    empresas_sem_formulario.add(nome)
-carregar_empresas_sem_formulario()
-
-root.mainloop()
\ No newline at end of file
+    try:
+        while not parar.is_set():
+            try:
+                nome, link = fila.get_nowait()
+            except Empty:
+                return
+            processar_empresa_http(sessao, nome, link)
+    finally:
+        sessao.close()
+
+def worker_chrome(fila, parar, navegadores):
+    # A sessão vem do gerenciador: verificada entre empresas, reciclada quando preciso e
+    # trocada se cair no meio de uma empresa, que então é refeita do início
+    driver = None
+    try:
+        while not parar.is_set():
+            try:
+                nome, link = fila.get_nowait()
+            except Empty:
+                return
+            for tentativa in range(TENTATIVAS_SESSAO + 1):
+                try:
+                    driver = navegadores.preparar(driver)
+                except Exception as e:
+                    driver = None
+                    fila.put((nome, link))  # fica para outro worker
+                    print(f"{threading.current_thread().name}: falha ao iniciar a sessão (chrome): {e}", flush=True)
+                    return
+                try:
+                    processar_empresa(driver, nome, link, refazer_se_cair=tentativa < TENTATIVAS_SESSAO)
+                    break
+                except SessaoPerdida as e:
+                    print(f"{threading.current_thread().name}: o Chrome caiu em {nome} ({e}); refazendo em outra sessão", flush=True)
+                    navegadores.descartar(driver)
+                    driver = None
+    finally:
+        if driver is not None:
+            navegadores.descartar(driver)
+
+def executar_headless(args):
+    global companies, total, tempo_inicio, ORDEM_OCR
+    if args.ocr:
+        ORDEM_OCR = args.ocr
+    if not any(backend_disponivel(nome_backend) for nome_backend in ORDEM_OCR):
+        descartar_driver_antecipado()
+        print(f"Nenhum backend de OCR disponível entre: {', '.join(ORDEM_OCR)}")
+        return 2
+    if args.pendentes:
+        companies = filtrar_empresas_faltantes()
+    if args.limite:
+        companies = companies[:args.limite]
+    if args.servidor:
+        companies = [(nome, redirecionar_link(link, args.servidor)) for nome, link in companies]
+    total = len(companies)
+    if total == 0:
+        descartar_driver_antecipado()
+        print("Todas as empresas já foram processadas com sucesso.")
+        return 0
+
+    fila = Queue()
+    for empresa in companies:
+        fila.put(empresa)
+    parar = threading.Event()
+    num_workers = max(1, min(args.workers, total))
+    navegadores = GerenciadorNavegadores() if args.motor == "chrome" else None
+    workers = [threading.Thread(target=worker_headless, args=(fila, parar, args.motor, navegadores), name=f"worker-{i+1}", daemon=True)
+               for i in range(num_workers)]
+
+    tempo_inicio = datetime.now()
+    for w in workers:
+        w.start()
+    marcar_inicializacao("workers")
+    try:
+        for w in workers:
+            while w.is_alive():
+                w.join(0.5)
+    except KeyboardInterrupt:
+        print("Execução interrompida pelo usuário. Aguardando os workers finalizarem a empresa atual...")
+        parar.set()
+        for w in workers:
+            w.join()
+    finally:
+        finalizar_html_diagnostico()
+        if navegadores is not None:
+            navegadores.encerrar()
+        descartar_driver_antecipado()
+
+    print(f"Concluído. Sucesso: {sucesso} | Falha: {falha} | Sem Formulário: {len(empresas_sem_formulario)}")
+    # Workers que não conseguiram abrir a sessão devolvem a empresa à fila e saem: se
+    # todos saíram, o que sobrou não foi processado nem registrado
+    restantes = fila.qsize()
+    if restantes:
+        print(f"{restantes} empresa(s) não processada(s): nenhuma sessão disponível ou execução interrompida.")
+        return 1
+    return 0
+
+# === BENCHMARK OCR ===
+def amostras_captchas(pasta=None):
+    # Imagens *_original.png salvas durante as execuções. O rótulo é o código aceito
+    # pelo site na tentativa mais recente da empresa (a imagem é sobrescrita a cada tentativa).
+    pasta = pasta or PASTA_CAPTCHAS
+    rotulos = {}
+    with lock_registro:
+        cursor = banco.execute("SELECT t.chave, e.nome, t.status, t.texto FROM tentativas t "
+                               "JOIN empresas e ON e.chave = t.chave ORDER BY t.id")
+        for chave, nome, status, texto in cursor:
+            aceito = situacao_do_status(status) in ("baixado", "sem_formulario") and re.fullmatch(r"\d{4}", texto or "")
+            rotulos[f"{nome_arquivo_base(chave, nome)}_original.png"] = texto if aceito else ""
+    if not os.path.isdir(pasta):
+        return []
+    # Imagens que estão no treino (cvm_treino, cvm_coletado) ficam sem rótulo: os backends
+    # treináveis as acertariam por tê-las visto. Rotuladas ficam só as de validação.
+    treino = hashes_amostras(amostras_classificador())
+    amostras = []
+    for arq in sorted(os.listdir(pasta)):
+        if arq.endswith("_original.png"):
+            caminho = os.path.join(pasta, arq)
+            label = rotulos.get(arq, "")
+            if label and hash_imagem(PILImage.open(caminho)) in treino:
+                label = ""
+            amostras.append((caminho, label))
+    return amostras
+
+def memoria_processo_mb():
+    return psutil.Process().memory_info().rss / (1024 * 1024) if psutil is not None else None
+
+def resposta_backend(backend, candidatos):
+    # O que ler_captcha() enviaria: o primeiro candidato de 4 dígitos com confiança suficiente
+    return next((d for _, _, d, c in candidatos if len(d) == 4 and c >= backend.confianca_minima), "")
+
+def avaliar_backend(backend, amostras, deixar_um_fora=False):
+    # amostras: [(caminho, imagem, rótulo ou "")]. Com deixar_um_fora, backends treináveis
+    # são treinados sem a própria amostra (o knn é montado a partir de cvm_treino).
+    latencias, acertos, respostas = [], 0, 0
+    memoria_inicial = memoria_pico = memoria_processo_mb()
+    backend.avaliando = True
+    for i, (caminho, image, label) in enumerate(amostras):
+        if deixar_um_fora:
+            backend.treinar([(c, l) for j, (c, _, l) in enumerate(amostras) if j != i and l])
+        inicio = time.perf_counter()
+        candidatos = backend.reconhecer(backend.preprocessar(image))
+        latencias.append((time.perf_counter() - inicio) * 1000)
+        resposta = resposta_backend(backend, candidatos)
+        respostas += bool(resposta)
+        acertos += bool(label) and resposta == label
+        if label:
+            backend.registrar_avaliacao(caminho, label)
+        if memoria_inicial is not None:
+            memoria_pico = max(memoria_pico, memoria_processo_mb())
+    backend.avaliando = False
+    rotuladas = sum(1 for _, _, label in amostras if label)
+    return {
+        "imagens": len(amostras),
+        "rotuladas": rotuladas,
+        "acerto": acertos / rotuladas * 100 if rotuladas else None,
+        "respondeu": respostas / len(amostras) * 100 if amostras else None,
+        "p50": float(np.percentile(latencias, 50)) if latencias else None,
+        "p95": float(np.percentile(latencias, 95)) if latencias else None,
+        "memoria": memoria_pico - memoria_inicial if memoria_inicial is not None else None,
+    }
+
+def executar_benchmark(args):
+    nomes = args.backends or list(BACKENDS_OCR)
+    desconhecidos = [n for n in nomes if n not in BACKENDS_OCR]
+    if desconhecidos:
+        print(f"Backends desconhecidos: {', '.join(desconhecidos)} (disponíveis: {', '.join(BACKENDS_OCR)})")
+        return 2
+    # Imagens carregadas antes da medição: a latência é só pré-processamento + reconhecimento
+    conjuntos = [("cvm_treino", amostras_treino())]
+    if not args.sem_captchas:
+        conjuntos.append(("captchas", amostras_captchas()[:args.limite or None]))
+    conjuntos = [(nome_conjunto, [(c, PILImage.open(c).convert("RGB"), l) for c, l in amostras])
+                 for nome_conjunto, amostras in conjuntos if amostras]
+    if not conjuntos:
+        print("Nenhuma imagem encontrada em cvm_treino/ ou captchas/.")
+        return 1
+
+    def formatar(valor, casas=1):
+        return "-" if valor is None else f"{valor:.{casas}f}"
+
+    print(f"{'backend':<21}{'conjunto':<12}{'imagens':>8}{'rotuladas':>10}{'acerto %':>10}"
+          f"{'respondeu %':>12}{'p50 ms':>9}{'p95 ms':>9}{'Δ RSS MB':>10}")
+    for nome_backend in nomes:
+        backend = BACKENDS_OCR[nome_backend]
+        if not backend.disponivel():
+            print(f"{nome_backend:<21}indisponível")
+            continue
+        for nome_conjunto, amostras in conjuntos:
+            deixar_um_fora = backend.treinavel and nome_conjunto == "cvm_treino"
+            # O deixar-um-fora retreina o backend: depois, volta o modelo carregado
+            estado = dict(vars(backend)) if deixar_um_fora else None
+            r = avaliar_backend(backend, amostras, deixar_um_fora)
+            if deixar_um_fora:
+                vars(backend).update(estado)
+            print(f"{nome_backend:<21}{nome_conjunto:<12}{r['imagens']:>8}{r['rotuladas']:>10}"
+                  f"{formatar(r['acerto']):>10}{formatar(r['respondeu']):>12}{formatar(r['p50'], 2):>9}"
+                  f"{formatar(r['p95'], 2):>9}{formatar(r['memoria']):>10}")
+    if psutil is None:
+        print("Instale o psutil para medir a memória.")
+    return 0
+
+# === REPROCESSAMENTO DE CAPTCHAS ===
+# Relê os captchas/*_original.png com outras configurações de pré-processamento e OCR,
+# sem acessar o site. Configuração: "backend" (pré-processamento do próprio backend) ou
+# "backend/variante" (uma das VARIANTES_PREPROCESSAMENTO). Os lotes rodam num pool de
+# processos; em cada lote uma variante é calculada uma vez para todas as configurações
+# e o backend lê o lote inteiro (reconhecer_lote: a CNN faz uma inferência por lote).
+def iniciar_processo_reprocessamento(psms, variantes, nomes_backends):
+    # Os processos do pool não abrem o banco: recebem as estatísticas do processo principal.
+    # Os modelos são carregados aqui para não entrar no tempo medido.
+    estatisticas_psm.update(psms)
+    estatisticas_variantes.update(variantes)
+    for nome_backend in nomes_backends:
+        BACKENDS_OCR[nome_backend].disponivel()
+
+def reprocessar_lote(caminhos, configuracoes):
+    imagens = [PILImage.open(c).convert("RGB") for c in caminhos]
+    processadas, tempos_variantes = {}, {}
+    respostas, tempos = {}, {}
+    for configuracao in configuracoes:
+        nome_backend, _, variante = configuracao.partition("/")
+        backend = BACKENDS_OCR[nome_backend]
+        variante = variante or backend.preprocessamento
+        if variante not in processadas:
+            preprocessar = VARIANTES_PREPROCESSAMENTO.get(variante, backend.preprocessar)
+            inicio = time.perf_counter()
+            processadas[variante] = [preprocessar(image) for image in imagens]
+            tempos_variantes[variante] = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        candidatos = backend.reconhecer_lote(processadas[variante])
+        tempos[configuracao] = time.perf_counter() - inicio + tempos_variantes[variante]
+        respostas[configuracao] = [resposta_backend(backend, c) for c in candidatos]
+    return respostas, tempos
+
+def escrever_html_reprocessamento(amostras, configuracoes, respostas, resumo):
+    with open(ARQUIVO_REPROCESSAMENTO, "w", encoding="utf-8") as html:
+        html.write("""
+    <html><head><title>Reprocessamento de CAPTCHAs</title>
+    <style>
+    body { font-family: Arial; background: #1e1e1e; color: #f0f0f0; }
+    table { border-collapse: collapse; margin-bottom: 30px; }
+    td, th { border: 1px solid #555; padding: 4px 10px; }
+    .success { color: #00ff00; }
+    .fail { color: #ff5555; }
+    </style>
+    </head><body><h1>Reprocessamento de CAPTCHAs</h1>
+    """)
+        html.write("<table><tr><th>Configuração</th><th>Imagens</th><th>Rotuladas</th><th>Acerto %</th>"
+                   "<th>Respondeu %</th><th>ms/imagem</th></tr>")
+        for configuracao in configuracoes:
+            r = resumo[configuracao]
+            html.write(f"<tr><td>{configuracao}</td><td>{r['imagens']}</td><td>{r['rotuladas']}</td>"
+                       f"<td>{r['acerto']}</td><td>{r['respondeu']}</td><td>{r['ms']}</td></tr>")
+        html.write("</table><table><tr><th>CAPTCHA</th><th>Código aceito</th>")
+        html.write("".join(f"<th>{configuracao}</th>" for configuracao in configuracoes) + "</tr>")
+        for i, (caminho, label) in enumerate(amostras):
+            rel = urllib.parse.quote(os.path.relpath(caminho).replace('\\', '/'))
+            html.write(f"<tr><td><img src='{rel}' height='40'></td><td>{label or '-'}</td>")
+            for configuracao in configuracoes:
+                resposta = respostas[configuracao][i]
+                estilo = "" if not label else "success" if resposta == label else "fail"
+                html.write(f"<td class='{estilo}'>{resposta or '-'}</td>")
+            html.write("</tr>")
+        html.write("</table></body></html>")
+
+def executar_reprocessamento(args):
+    configuracoes = args.configuracoes or [nome for nome, backend in BACKENDS_OCR.items() if backend.disponivel()]
+    for configuracao in configuracoes:
+        nome_backend, _, variante = configuracao.partition("/")
+        if nome_backend not in BACKENDS_OCR or (variante and variante not in VARIANTES_PREPROCESSAMENTO):
+            print(f"Configuração desconhecida: {configuracao} (backends: {', '.join(BACKENDS_OCR)}; "
+                  f"variantes: {', '.join(VARIANTES_PREPROCESSAMENTO)})")
+            return 2
+        backend = BACKENDS_OCR[nome_backend]
+        if variante and backend.preprocessamento != "opencv":
+            print(f"{nome_backend} tem pré-processamento próprio e não aceita variante: {configuracao}")
+            return 2
+        if not backend.disponivel():
+            print(f"Backend indisponível: {nome_backend}")
+            return 1
+    amostras = amostras_captchas()[:args.limite or None]
+    if not amostras:
+        print(f"Nenhuma imagem *_original.png em {PASTA_CAPTCHAS}/.")
+        return 1
+
+    caminhos = [c for c, _ in amostras]
+    lotes = [caminhos[i:i + args.lote] for i in range(0, len(caminhos), args.lote)]
+    processos = args.processos or os.cpu_count() or 1
+    respostas = {configuracao: [] for configuracao in configuracoes}
+    tempos = dict.fromkeys(configuracoes, 0.0)
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(processos, initializer=iniciar_processo_reprocessamento,
+                             initargs=(dict(estatisticas_psm), dict(estatisticas_variantes),
+                                       {c.partition("/")[0] for c in configuracoes})) as pool:
+        for respostas_lote, tempos_lote in pool.map(reprocessar_lote, lotes, [configuracoes] * len(lotes)):
+            for configuracao in configuracoes:
+                respostas[configuracao].extend(respostas_lote[configuracao])
+                tempos[configuracao] += tempos_lote[configuracao]
+    duracao = time.perf_counter() - inicio
+
+    rotulos = [label for _, label in amostras]
+    rotuladas = sum(1 for label in rotulos if label)
+    resumo = {}
+    print(f"{'configuração':<32}{'imagens':>8}{'rotuladas':>10}{'acerto %':>10}{'respondeu %':>12}{'ms/imagem':>11}")
+    for configuracao in configuracoes:
+        acertos = sum(1 for resposta, label in zip(respostas[configuracao], rotulos) if label and resposta == label)
+        respondidas = sum(1 for resposta in respostas[configuracao] if resposta)
+        resumo[configuracao] = {
+            "imagens": len(amostras),
+            "rotuladas": rotuladas,
+            "acerto": f"{acertos / rotuladas * 100:.1f}" if rotuladas else "-",
+            "respondeu": f"{respondidas / len(amostras) * 100:.1f}",
+            "ms": f"{tempos[configuracao] / len(amostras) * 1000:.2f}",
+        }
+        r = resumo[configuracao]
+        print(f"{configuracao:<32}{r['imagens']:>8}{r['rotuladas']:>10}{r['acerto']:>10}{r['respondeu']:>12}{r['ms']:>11}")
+    escrever_html_reprocessamento(amostras, configuracoes, respostas, resumo)
+    print(f"{len(amostras)} imagens em {duracao:.1f} s com {processos} processo(s). Tabela: {ARQUIVO_REPROCESSAMENTO}")
+    return 0
+
+# === TREINO TESSERACT ===
+# Ajuste fino (LSTM) do eng.traineddata com as amostras rotuladas de cvm_treino e
+# cvm_coletado, gerando modelos/cvm.traineddata. Precisa das ferramentas de treino do
+# Tesseract 4/5 (tesseract, combine_tessdata, lstmtraining) e de um eng.traineddata
+# do tessdata_best: os modelos "fast" são inteiros e não aceitam ajuste fino.
+def box_linha(label, largura, altura):
+    # Amostra sem .box: cada caractere recebe a caixa da linha inteira (como no tesstrain)
+    linhas = [f"{c} 0 0 {largura} {altura} 0" for c in label]
+    linhas.append(f"\t 0 0 {largura} {altura} 0")
+    return "\n".join(linhas) + "\n"
+
+def rodar_ferramenta(comando):
+    resultado = subprocess.run(comando, capture_output=True, text=True)
+    if resultado.returncode != 0:
+        raise RuntimeError(f"{' '.join(comando)} falhou:\n{resultado.stderr.strip()}")
+    return resultado
+
+def executar_treino_tesseract(args):
+    faltando = [f for f in ("tesseract", "combine_tessdata", "lstmtraining") if shutil.which(f) is None]
+    if faltando:
+        print(f"Ferramentas de treino do Tesseract não encontradas no PATH: {', '.join(faltando)}")
+        return 1
+    tessdata = args.tessdata or os.environ.get("TESSDATA_PREFIX", "")
+    modelo_base = os.path.join(tessdata, "eng.traineddata")
+    if not os.path.exists(modelo_base):
+        print(f"eng.traineddata não encontrado em '{tessdata}' (use --tessdata com a pasta do tessdata_best)")
+        return 1
+    amostras = amostras_treino() if args.sem_coletados else amostras_classificador()
+    if not amostras:
+        print("Nenhuma amostra rotulada em cvm_treino/ ou cvm_coletado/.")
+        return 1
+
+    # Pasta de trabalho recriada do zero: o mesmo conjunto gera sempre o mesmo treino
+    pasta = os.path.join(PASTA_MODELOS, f"treino_{MODELO_TESSERACT_CVM}")
+    shutil.rmtree(pasta, ignore_errors=True)
+    os.makedirs(pasta)
+    print(f"Gerando .lstmf de {len(amostras)} amostras...")
+    lstmfs = []
+    for i, (caminho, label) in enumerate(amostras, start=1):
+        base_amostra = os.path.join(pasta, f"{i:05d}")
+        shutil.copyfile(caminho, base_amostra + ".png")
+        box_original = os.path.splitext(caminho)[0] + ".box"
+        if os.path.exists(box_original):
+            shutil.copyfile(box_original, base_amostra + ".box")
+        else:
+            with PILImage.open(caminho) as img:
+                largura, altura = img.size
+            with open(base_amostra + ".box", "w", encoding="utf-8") as f:
+                f.write(box_linha(label, largura, altura))
+        rodar_ferramenta(["tesseract", base_amostra + ".png", base_amostra, "--tessdata-dir", tessdata,
+                          "--psm", str(PSM_MODELO_CVM), "lstm.train"])
+        if os.path.exists(base_amostra + ".lstmf"):
+            lstmfs.append(os.path.abspath(base_amostra + ".lstmf"))
+
+    # Uma amostra em cada 10 fica para avaliação durante o treino
+    avaliacao = lstmfs[9::10] if len(lstmfs) >= 20 else []
+    treino = [f for f in lstmfs if f not in avaliacao]
+    lista_treino = os.path.join(pasta, "lista.treino")
+    lista_avaliacao = os.path.join(pasta, "lista.avaliacao")
+    with open(lista_treino, "w", encoding="utf-8") as f:
+        f.write("\n".join(treino) + "\n")
+    with open(lista_avaliacao, "w", encoding="utf-8") as f:
+        f.write("\n".join(avaliacao) + "\n")
+
+    lstm_base = os.path.join(pasta, "eng.lstm")
+    rodar_ferramenta(["combine_tessdata", "-e", modelo_base, lstm_base])
+    checkpoint = os.path.join(pasta, MODELO_TESSERACT_CVM)
+    comando = ["lstmtraining", "--continue_from", lstm_base, "--traineddata", modelo_base,
+               "--model_output", checkpoint, "--train_listfile", lista_treino,
+               "--max_iterations", str(args.iteracoes)]
+    if avaliacao:
+        comando += ["--eval_listfile", lista_avaliacao]
+    print(f"Treinando ({len(treino)} amostras de treino, {len(avaliacao)} de avaliação, {args.iteracoes} iterações)...")
+    resultado = rodar_ferramenta(comando)
+    print(resultado.stderr.strip().splitlines()[-1] if resultado.stderr.strip() else "")
+
+    saida = os.path.join(PASTA_MODELOS, f"{MODELO_TESSERACT_CVM}.traineddata")
+    rodar_ferramenta(["lstmtraining", "--stop_training", "--continue_from", checkpoint + "_checkpoint",
+                      "--traineddata", modelo_base, "--model_output", saida])
+    with open(modelo_base, "rb") as f:
+        hash_base = hashlib.sha256(f.read()).hexdigest()
+    with open(os.path.splitext(saida)[0] + ".json", "w", encoding="utf-8") as f:
+        json.dump({"gerado_em": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "modelo_base_sha256": hash_base,
+                   "amostras": len(amostras), "treino": len(treino), "avaliacao": len(avaliacao),
+                   "iteracoes": args.iteracoes, "psm": PSM_MODELO_CVM}, f, indent=2)
+    print(f"Modelo gerado: {saida} (use com: headless --ocr knn tesseract-cvm)")
+    return 0
+
+# === TREINO CNN ===
+def executar_treino_cnn(args):
+    amostras = amostras_treino() if args.sem_coletados else amostras_classificador()
+    if not amostras:
+        print("Nenhuma amostra rotulada em cvm_treino/ ou cvm_coletado/.")
+        return 1
+    print(f"Treinando a CNN com {len(amostras)} CAPTCHAs ({args.epocas} épocas)...")
+    inicio = time.perf_counter()
+    pesos = treinar_cnn(amostras, epocas=args.epocas)
+    if pesos is None:
+        print("Nenhuma amostra pôde ser segmentada em 4 dígitos.")
+        return 1
+    os.makedirs(PASTA_MODELOS, exist_ok=True)
+    np.savez(ARQUIVO_CNN, **pesos)
+    print(f"Modelo gerado: {ARQUIVO_CNN} ({time.perf_counter() - inicio:.1f} s). Compare com: benchmark --backends knn cnn tesseract")
+    return 0
+
+# === MAIN ===
+def main():
+    global companies, total, medir_inicializacao, COLETAR_CAPTCHAS
+    marcar_inicializacao("modulo")
+    parser = argparse.ArgumentParser(description="Extrator de Formulários da CVM")
+    parser.add_argument("--medir-inicializacao", action="store_true",
+                        help="Para na primeira navegação e imprime o tempo de cada etapa da inicialização")
+    subparsers = parser.add_subparsers(dest="comando")
+    parser_headless = subparsers.add_parser("headless", help="Executa o fluxo OCR completo sem interface gráfica")
+    parser_headless.add_argument("--pendentes", action="store_true", help="Processa apenas empresas ainda sem formulário baixado")
+    parser_headless.add_argument("--limite", type=int, default=0, help="Número máximo de empresas a processar")
+    parser_headless.add_argument("--workers", type=int, default=NUM_WORKERS, help="Número de sessões (Chrome ou HTTP) em paralelo")
+    parser_headless.add_argument("--motor", choices=["chrome", "http"], default="chrome",
+                                 help="chrome: navegador controlado pelo Selenium; http: apenas requests, sem navegador")
+    parser_headless.add_argument("--servidor", default="", help="Redireciona os links para outro host (ex.: http://127.0.0.1:8000 do servidor_teste_cvm.py)")
+    parser_headless.add_argument("--saida", default="",
+                                 help=f"Pasta para banco, log, formulários e captchas (padrão com --servidor: {PASTA_SAIDA_TESTE})")
+    parser_headless.add_argument("--ocr", nargs="+", choices=list(BACKENDS_OCR),
+                                 help=f"Backends de OCR, na ordem em que são tentados (padrão: {' '.join(ORDEM_OCR)})")
+    parser_benchmark = subparsers.add_parser("benchmark", help="Compara os backends de OCR nas amostras rotuladas")
+    parser_benchmark.add_argument("--backends", nargs="+", help=f"Backends a avaliar (padrão: todos; registrados: {', '.join(BACKENDS_OCR)})")
+    parser_benchmark.add_argument("--sem-captchas", action="store_true", help="Usa apenas cvm_treino, sem as imagens salvas em captchas/")
+    parser_benchmark.add_argument("--limite", type=int, default=0, help="Número máximo de imagens de captchas/")
+    parser_reproc = subparsers.add_parser("reprocessar-captchas", help="Relê os captchas/*_original.png com outras configurações de OCR")
+    parser_reproc.add_argument("--configuracoes", nargs="+",
+                               help="backend ou backend/variante (ex.: knn cnn/adaptativo tesseract/recorte; padrão: backends disponíveis)")
+    parser_reproc.add_argument("--processos", type=int, default=0, help="Processos em paralelo (padrão: número de CPUs)")
+    parser_reproc.add_argument("--lote", type=int, default=LOTE_REPROCESSAMENTO, help="Imagens por tarefa do pool")
+    parser_reproc.add_argument("--limite", type=int, default=0, help="Número máximo de imagens")
+    parser_cnn = subparsers.add_parser("treinar-cnn", help="Treina a rede convolucional de dígitos (modelos/cnn_digitos.npz)")
+    parser_cnn.add_argument("--epocas", type=int, default=30, help="Épocas de treino")
+    parser_cnn.add_argument("--sem-coletados", action="store_true", help="Usa apenas cvm_treino, sem cvm_coletado")
+    parser_treino = subparsers.add_parser("treinar-tesseract", help="Gera modelos/cvm.traineddata a partir das amostras rotuladas")
+    parser_treino.add_argument("--tessdata", default="", help="Pasta com o eng.traineddata do tessdata_best (padrão: TESSDATA_PREFIX)")
+    parser_treino.add_argument("--iteracoes", type=int, default=400, help="Iterações do lstmtraining")
+    parser_treino.add_argument("--sem-coletados", action="store_true", help="Usa apenas cvm_treino, sem cvm_coletado")
+    parser_inicio = subparsers.add_parser("benchmark-inicializacao",
+                                          help="Mede o tempo até a primeira janela e até a primeira navegação")
+    parser_inicio.add_argument("--modo", choices=["gui", "headless"], default="gui")
+    parser_inicio.add_argument("--motor", choices=["chrome", "http"], default="chrome", help="Motor do modo headless")
+    parser_inicio.add_argument("--servidor", default="", help="Servidor do modo headless (ex.: servidor_teste_cvm.py)")
+    parser_inicio.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+    medir_inicializacao = args.medir_inicializacao
+
+    if args.comando is None or (args.comando == "headless" and args.motor == "chrome"):
+        antecipar_driver(headless=args.comando == "headless")
+    if args.comando == "headless" and (args.servidor or args.saida):
+        usar_pasta_saida(args.saida or PASTA_SAIDA_TESTE)
+    if args.comando == "headless" and args.servidor:
+        COLETAR_CAPTCHAS = False  # CAPTCHAs do servidor de teste são cópias de cvm_treino
+    preparar_pastas()
+    companies = carregar_empresas()
+    marcar_inicializacao("planilha")
+    abrir_banco()
+    marcar_inicializacao("banco")
+    total = len(companies)
+    if args.comando == "benchmark-inicializacao":
+        return executar_benchmark_inicializacao(args)
+    if args.comando == "benchmark":
+        return executar_benchmark(args)
+    if args.comando == "reprocessar-captchas":
+        return executar_reprocessamento(args)
+    if args.comando == "treinar-tesseract":
+        return executar_treino_tesseract(args)
+    if args.comando == "treinar-cnn":
+        return executar_treino_cnn(args)
+    iniciar_html_diagnostico()
+    carregar_empresas_sem_formulario()
+
+    if args.comando == "headless":
+        if medir_inicializacao:
+            args.limite = 1
+        resultado = executar_headless(args)
+    else:
+        iniciar_gui()
+        resultado = 0
+    if medir_inicializacao:
+        print("MARCOS_INICIALIZACAO " + json.dumps(marcos_inicializacao), flush=True)
+    return resultado
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,206 @@
+# Servidor local que imita o fluxo de CAPTCHA do cadastro da CVM, para testes offline.
+#
+# Uso:
+#   python servidor_teste_cvm.py --porta 8000
+#   python "CVM Form Extractor Alpha v1.8.py" headless --motor http --servidor http://127.0.0.1:8000
+#
+# Os CAPTCHAs servidos são as amostras rotuladas de cvm_treino/captchas, então o OCR
+# é exercitado com imagens reais e o código esperado é conhecido. Os PDFs aceitam
+# Range/If-Range e --falha-download derruba parte das transferências no meio.
+import argparse
+import hashlib
+import os
+import random
+import secrets
+import threading
+import urllib.parse
+from html import escape
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PASTA_TREINO = os.path.join("cvm_treino", "captchas")
+ARQUIVO_LABELS = os.path.join("cvm_treino", "labels.txt")
+CAMINHO_BASE = "/asp/cvmwww/cadastro/"
+COOKIE_SESSAO = "ASPSESSIONIDCVMTESTE"
+CHARSET = "iso-8859-1"
+
+def carregar_amostras():
+    with open(ARQUIVO_LABELS, encoding="utf-8") as f:
+        labels = [linha.strip() for linha in f if linha.strip()]
+    amostras = []
+    for i, label in enumerate(labels, start=1):
+        caminho = os.path.join(PASTA_TREINO, f"{i:02d}.png")
+        if os.path.exists(caminho):
+            with open(caminho, "rb") as img:
+                amostras.append((label, img.read()))
+    return amostras
+
+def gerar_pdf(chave, tamanho=300_000):
+    # PDF sintético e determinístico por participante (cabeçalho %PDF e trailer %%EOF)
+    rnd = random.Random(chave)
+    corpo = rnd.randbytes(tamanho)
+    return b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n" + corpo + b"\n%%EOF\n"
+
+def tem_formulario(cpfcgc):
+    # Uma em cada cinco empresas não tem Formulário de Referência
+    digitos = "".join(filter(str.isdigit, cpfcgc or "")) or "0"
+    return int(digitos) % 5 != 0
+
+class EstadoServidor:
+    def __init__(self, amostras, falha_download=0.0):
+        self.amostras = amostras
+        self.falha_download = falha_download
+        self.sessoes = {}
+        self.lock = threading.Lock()
+
+    def novo_captcha(self, sessao):
+        label, png = random.choice(self.amostras)
+        with self.lock:
+            self.sessoes[sessao] = label
+        return png
+
+    def validar(self, sessao, codigo):
+        with self.lock:
+            return codigo and self.sessoes.pop(sessao, None) == codigo
+
+class HandlerCVM(BaseHTTPRequestHandler):
+    estado = None
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _sessao(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        if COOKIE_SESSAO in cookie:
+            return cookie[COOKIE_SESSAO].value, False
+        return secrets.token_hex(12), True
+
+    def _responder(self, status, corpo, tipo, sessao=None, nova=False, cabecalhos=None):
+        self.send_response(status)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(corpo)))
+        if nova:
+            self.send_header("Set-Cookie", f"{COOKIE_SESSAO}={sessao}; path=/")
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(corpo)
+
+    def _html(self, corpo, sessao, nova, status=200):
+        pagina = f"<html><head><title>CVM - Cadastro</title></head><body>{corpo}</body></html>"
+        self._responder(status, pagina.encode(CHARSET, errors="xmlcharrefreplace"),
+                        f"text/html; charset={CHARSET}", sessao, nova)
+
+    def _pagina_captcha(self, params, sessao, nova, erro=""):
+        ocultos = "".join(
+            f"<input type='hidden' name='{escape(k)}' value='{escape(v)}'>"
+            for k, v in params.items() if k != "strCAPTCHA"
+        )
+        aviso = f"<p><font color='red'>{erro}</font></p>" if erro else ""
+        self._html(
+            f"{aviso}<form name='frmCaptcha' method='post' action='RedirCad.asp'>{ocultos}"
+            "<img src='captcha/aspcaptcha.asp' alt='CAPTCHA'>"
+            "<input type='text' name='strCAPTCHA' maxlength='4'>"
+            "<input type='submit' name='btnEnviar' value='Continuar'></form>",
+            sessao, nova,
+        )
+
+    def _pagina_resultado(self, params, sessao, nova):
+        cpfcgc = params.get("Cpfcgc_Partic", "")
+        corpo = f"<h2>Participante {escape(cpfcgc)}</h2>"
+        if tem_formulario(cpfcgc):
+            corpo += f"<a href='formulario.pdf?Cpfcgc_Partic={urllib.parse.quote(cpfcgc)}'>Formulário de Referência</a>"
+        else:
+            corpo += "<p>Nenhum documento disponível.</p>"
+        self._html(corpo, sessao, nova)
+
+    def _params(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        return url.path, params
+
+    def do_GET(self):
+        caminho, params = self._params()
+        sessao, nova = self._sessao()
+        if caminho == CAMINHO_BASE + "RedirCad.asp":
+            self._pagina_captcha(params, sessao, nova)
+        elif caminho == CAMINHO_BASE + "captcha/aspcaptcha.asp":
+            png = self.estado.novo_captcha(sessao)
+            self._responder(200, png, "image/png", sessao, nova, {"Cache-Control": "no-cache"})
+        elif caminho == CAMINHO_BASE + "formulario.pdf":
+            self._enviar_pdf(gerar_pdf(params.get("Cpfcgc_Partic", "")), sessao, nova)
+        else:
+            self._html("<p>Página não encontrada</p>", sessao, nova, status=404)
+
+    do_HEAD = do_GET
+
+    def _enviar_pdf(self, pdf, sessao, nova):
+        etag = '"' + hashlib.md5(pdf).hexdigest() + '"'
+        cabecalhos = {"ETag": etag, "Accept-Ranges": "bytes"}
+        inicio, fim = 0, len(pdf) - 1
+        faixa = self.headers.get("Range", "")
+        if_range = self.headers.get("If-Range")
+        if faixa.startswith("bytes=") and (not if_range or if_range == etag):
+            try:
+                a, _, b = faixa[len("bytes="):].partition("-")
+                inicio, fim = int(a), min(int(b) if b else len(pdf) - 1, len(pdf) - 1)
+            except ValueError:
+                inicio = len(pdf)
+            if inicio >= len(pdf):
+                cabecalhos["Content-Range"] = f"bytes */{len(pdf)}"
+                self._responder(416, b"", "application/pdf", sessao, nova, cabecalhos)
+                return
+            cabecalhos["Content-Range"] = f"bytes {inicio}-{fim}/{len(pdf)}"
+            status = 206
+        else:
+            status = 200
+        corpo = pdf[inicio:fim + 1]
+        if random.random() < self.estado.falha_download:
+            # Anuncia o tamanho completo mas encerra a conexão no meio do corpo
+            self.send_response(status)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(len(corpo)))
+            for nome, valor in cabecalhos.items():
+                self.send_header(nome, valor)
+            self.end_headers()
+            self.wfile.write(corpo[:len(corpo) // 2])
+            self.close_connection = True
+            return
+        self._responder(status, corpo, "application/pdf", sessao, nova, cabecalhos)
+
+    def do_POST(self):
+        caminho, _ = self._params()
+        sessao, nova = self._sessao()
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        dados = self.rfile.read(tamanho).decode(CHARSET)
+        params = dict(urllib.parse.parse_qsl(dados, keep_blank_values=True))
+        if caminho != CAMINHO_BASE + "RedirCad.asp":
+            self._html("<p>Página não encontrada</p>", sessao, nova, status=404)
+        elif self.estado.validar(sessao, params.get("strCAPTCHA", "")):
+            self._pagina_resultado(params, sessao, nova)
+        else:
+            self._pagina_captcha(params, sessao, nova, erro="Código de verificação inválido.")
+
+def criar_servidor(host="127.0.0.1", porta=8000, falha_download=0.0):
+    HandlerCVM.estado = EstadoServidor(carregar_amostras(), falha_download)
+    return ThreadingHTTPServer((host, porta), HandlerCVM)
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que imita o cadastro da CVM (testes offline)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8000)
+    parser.add_argument("--falha-download", type=float, default=0.0,
+                        help="Probabilidade (0-1) de interromper um download de PDF no meio")
+    args = parser.parse_args()
+    servidor = criar_servidor(args.host, args.porta, args.falha_download)
+    print(f"Servidor de teste em http://{args.host}:{args.porta}{CAMINHO_BASE}RedirCad.asp")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+if __name__ == "__main__":
+    main()